@@ -0,0 +1,243 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import cv2
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from features.caching import bytes_digest
+from features.color_conversion import rgb_to_hsi, rgb_to_yiq
+from features.color_engine import SPACES, convert, convert_all
+from features.color_lut import get_color_lut
+from features.face_dataset import detect_faces
+from features.image_analysis import generate_freeman_chain_code, process_integral_projection
+from features.image_compression import JPEG_QUALITIES, process_jpeg_compression, process_png_compression
+from features.image_processing import apply_convolution, apply_filter, apply_fourier_transform, reduce_periodic_noise
+from features.jpeg_model import predict_jpeg_sizes
+from features.results_store import configure_results_store
+from features.spectrum import get_spectrum_engine
+
+RESOLUTIONS = {
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+    "4k": (3840, 2160),
+    "8k": (7680, 4320),
+}
+MODES = ("color", "gray")
+
+# measure the computation, not lookups in the persistent results store
+configure_results_store(None)
+
+def synthetic_image(width, height, mode, seed=0):
+    """Deterministic photo-like test image: smooth shading, shapes and grain."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (9, 16, 3), dtype=np.uint8)
+    img = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    scale = min(width, height)
+    for _ in range(12):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            cv2.circle(img, center, int(rng.integers(scale // 20, scale // 5)), color, -1)
+        else:
+            size = rng.integers(scale // 20, scale // 4, 2)
+            cv2.rectangle(img, center, (center[0] + int(size[0]), center[1] + int(size[1])), color, -1)
+    grain = rng.normal(0, 4, img.shape)
+    img = np.clip(img + grain, 0, 255).astype(np.uint8)
+    if mode == "gray":
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img
+
+def uncached(func):
+    return getattr(func, "__wrapped__", func)
+
+def largest_contour(img):
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    return max(contours, key=cv2.contourArea)
+
+def compression_case(func):
+    def prepare(img):
+        is_color = img.ndim == 3
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB) if is_color else img
+        ok, encoded = cv2.imencode(".png", img)
+        # the page keys these by the upload's bytes
+        return (bytes_digest(encoded.tobytes()), rgb, is_color, len(encoded)), {}
+    return uncached(func), prepare
+
+def convert_all_spaces(rgb, out):
+    for space in SPACES:
+        convert(rgb, space, out=out)
+
+def color_case(img):
+    return (cv2.cvtColor(img, cv2.COLOR_BGR2RGB), np.empty(img.shape, np.float32)), {}
+
+def lut_case(img):
+    # build or load the table outside the timed calls
+    get_color_lut("HSI").table
+    args, kwargs = color_case(img)
+    return (args[0], "HSI", args[1]), {"backend": "lut"}
+
+def clear_spectrum_cache():
+    get_spectrum_engine().cache.clear()
+
+# name -> (callable, prepare(img) -> (args, kwargs), supported modes, per-call setup)
+BENCHMARKS = {
+    "apply_convolution": (apply_convolution, lambda img: ((img, "sharpen"), {}), MODES, None),
+    "apply_filter": (apply_filter, lambda img: ((img, "low"), {}), MODES, None),
+    "apply_fourier_transform": (apply_fourier_transform, lambda img: ((img,), {}), MODES, clear_spectrum_cache),
+    "reduce_periodic_noise": (reduce_periodic_noise, lambda img: ((img,), {}), MODES, clear_spectrum_cache),
+    "rgb_to_yiq": (rgb_to_yiq, lambda img: ((cv2.cvtColor(img, cv2.COLOR_BGR2RGB),), {}), ("color",), None),
+    "rgb_to_hsi": (rgb_to_hsi, lambda img: ((cv2.cvtColor(img, cv2.COLOR_BGR2RGB),), {}), ("color",), None),
+    "convert_all_spaces": (convert_all_spaces, color_case, ("color",), None),
+    "convert_hsi_lut": (convert, lut_case, ("color",), None),
+    "convert_all": (convert_all, lambda img: ((cv2.cvtColor(img, cv2.COLOR_BGR2RGB), SPACES), {}), ("color",), None),
+    "generate_freeman_chain_code": (generate_freeman_chain_code, lambda img: ((largest_contour(img),), {}), MODES, None),
+    "process_integral_projection": (process_integral_projection, lambda img: ((img,), {}), MODES, None),
+    "process_jpeg_compression": compression_case(process_jpeg_compression) + (MODES, None),
+    "process_png_compression": compression_case(process_png_compression) + (MODES, None),
+    "predict_jpeg_sizes": (predict_jpeg_sizes, lambda img: ((img, img.ndim == 3, JPEG_QUALITIES), {}), MODES, None),
+    "detect_faces": (detect_faces, lambda img: ((img,), {}), ("color",), None),
+}
+
+def measure(func, args, kwargs, setup, repeat):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+        plt.close("all")
+    # separate run so tracing overhead does not distort the timings;
+    # tracemalloc sees NumPy buffers but not OpenCV-internal allocations
+    if setup:
+        setup()
+    tracemalloc.start()
+    func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    plt.close("all")
+    return times, peak
+
+def run(functions, resolutions, modes, repeat, progress=None):
+    results = []
+    for resolution in resolutions:
+        width, height = RESOLUTIONS[resolution]
+        for mode in modes:
+            img = synthetic_image(width, height, mode)
+            for name in functions:
+                func, prepare, supported, setup = BENCHMARKS[name]
+                if mode not in supported:
+                    continue
+                args, kwargs = prepare(img)
+                times, peak = measure(func, args, kwargs, setup, repeat)
+                median = statistics.median(times)
+                row = {
+                    "function": name,
+                    "resolution": resolution,
+                    "mode": mode,
+                    "width": width,
+                    "height": height,
+                    "repeat": repeat,
+                    "time_min": min(times),
+                    "time_median": median,
+                    "megapixels_per_second": width * height / 1e6 / median if median > 0 else None,
+                    "peak_memory_bytes": peak,
+                }
+                results.append(row)
+                if progress:
+                    progress(row)
+    return results
+
+def environment():
+    return {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "opencv_threads": cv2.getNumThreads(),
+    }
+
+def compare(old, new, threshold):
+    key = lambda row: (row["function"], row["resolution"], row["mode"])
+    baseline = {key(row): row for row in old["results"]}
+    rows = []
+    for row in new["results"]:
+        before = baseline.get(key(row))
+        if before is None or not before["time_median"]:
+            continue
+        ratio = row["time_median"] / before["time_median"]
+        memory_ratio = row["peak_memory_bytes"] / before["peak_memory_bytes"] if before["peak_memory_bytes"] else None
+        regression = ratio > 1 + threshold or (memory_ratio is not None and memory_ratio > 1 + threshold)
+        rows.append((key(row), before["time_median"], row["time_median"], ratio, memory_ratio, regression))
+    return rows
+
+def print_row(row):
+    print(f"{row['function']:<30} {row['resolution']:<5} {row['mode']:<6} "
+          f"{row['time_median'] * 1000:>10.1f} ms {row['megapixels_per_second'] or 0:>9.1f} MP/s "
+          f"{row['peak_memory_bytes'] / 1024 ** 2:>9.1f} MB", flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the compute functions in features/.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Run the benchmarks and write a JSON report")
+    run_parser.add_argument("-o", "--output", default="bench_results.json")
+    run_parser.add_argument("-f", "--functions", default=",".join(BENCHMARKS),
+                            help="Comma-separated subset of: " + ", ".join(BENCHMARKS))
+    run_parser.add_argument("-r", "--resolutions", default="vga,hd,fhd,4k",
+                            help="Comma-separated subset of: " + ", ".join(RESOLUTIONS))
+    run_parser.add_argument("-m", "--modes", default=",".join(MODES))
+    run_parser.add_argument("-n", "--repeat", type=int, default=3)
+
+    compare_parser = sub.add_parser("compare", help="Compare two JSON reports and flag regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("-t", "--threshold", type=float, default=0.10,
+                                help="Relative slowdown / memory growth counted as a regression")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        functions = args.functions.split(",")
+        resolutions = args.resolutions.split(",")
+        modes = args.modes.split(",")
+        for name, valid in ((functions, BENCHMARKS), (resolutions, RESOLUTIONS), (modes, MODES)):
+            unknown = [n for n in name if n not in valid]
+            if unknown:
+                parser.error(f"Unknown choice(s): {', '.join(unknown)}")
+        results = run(functions, resolutions, modes, args.repeat, progress=print_row)
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+        print(f"Wrote {len(results)} results to {args.output}")
+        return 0
+
+    with open(args.baseline) as f:
+        old = json.load(f)
+    with open(args.candidate) as f:
+        new = json.load(f)
+    rows = compare(old, new, args.threshold)
+    regressions = 0
+    for (name, resolution, mode), before, after, ratio, memory_ratio, regression in rows:
+        regressions += regression
+        memory = f"{memory_ratio:.2f}x mem" if memory_ratio is not None else ""
+        flag = "REGRESSION" if regression else ""
+        print(f"{name:<30} {resolution:<5} {mode:<6} {before * 1000:>10.1f} -> {after * 1000:>10.1f} ms "
+              f"{ratio:>6.2f}x {memory:>10} {flag}")
+    print(f"{regressions} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
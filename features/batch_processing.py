@@ -0,0 +1,127 @@
+import argparse
+import glob
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+from features.image_processing import OPERATIONS
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+def parse_params(pairs):
+    params = {}
+    for pair in pairs or []:
+        if "=" not in pair:
+            raise ValueError(f"Invalid parameter '{pair}', expected key=value")
+        key, value = pair.split("=", 1)
+        try:
+            params[key] = int(value)
+        except ValueError:
+            try:
+                params[key] = float(value)
+            except ValueError:
+                params[key] = value
+    return params
+
+def collect_inputs(source):
+    if os.path.isdir(source):
+        root = source
+        paths = []
+        for dirpath, _, filenames in os.walk(source):
+            for name in filenames:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(dirpath, name))
+    else:
+        root = None
+        paths = [p for p in glob.glob(source, recursive=True) if p.lower().endswith(IMAGE_EXTENSIONS)]
+    return root, sorted(paths)
+
+def output_path_for(path, root, output_dir, extension=None):
+    relative = os.path.relpath(path, root) if root else os.path.basename(path)
+    stem, ext = os.path.splitext(relative)
+    return os.path.join(output_dir, stem + (extension or ext))
+
+def to_uint8(image):
+    if image.dtype == np.uint8:
+        return image
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+def process_file(job):
+    path, output_path, operation, params = job
+    try:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("cannot decode image")
+        result = OPERATIONS[operation](img, **params)
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        if not cv2.imwrite(output_path, to_uint8(result)):
+            raise ValueError(f"cannot write {output_path}")
+        return path, None
+    except Exception as e:
+        return path, f"{type(e).__name__}: {e}"
+
+def run_batch(source, operation, params, output_dir, workers=None, chunksize=8, extension=None, skip_existing=False, progress=None):
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown operation '{operation}'. Choose from: {', '.join(OPERATIONS)}")
+    root, paths = collect_inputs(source)
+    jobs = []
+    for path in paths:
+        output_path = output_path_for(path, root, output_dir, extension)
+        if skip_existing and os.path.exists(output_path):
+            continue
+        jobs.append((path, output_path, operation, params))
+
+    failures = []
+    done = 0
+    with Pool(processes=workers) as pool:
+        for path, error in pool.imap_unordered(process_file, jobs, chunksize=chunksize):
+            done += 1
+            if error is not None:
+                failures.append((path, error))
+            if progress is not None:
+                progress(done, len(jobs), path, error)
+    return len(jobs), failures
+
+def print_progress(done, total, path, error):
+    status = "FAILED " + error if error else "ok"
+    print(f"[{done}/{total}] {path}: {status}", file=sys.stderr, flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply an image processing operation to many images in parallel.")
+    parser.add_argument("input", help="Input directory (searched recursively) or glob pattern")
+    parser.add_argument("operation", choices=sorted(OPERATIONS), help="Operation to apply")
+    parser.add_argument("output", help="Output directory")
+    parser.add_argument("-p", "--param", action="append", metavar="KEY=VALUE", help="Operation parameter, e.g. kernel_type=sharpen (repeatable)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=8, help="Files handed to a worker at a time")
+    parser.add_argument("--format", dest="extension", default=None, help="Output extension, e.g. .png (default: same as input)")
+    parser.add_argument("--skip-existing", action="store_true", help="Skip files whose output already exists")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only report failures and the summary")
+    args = parser.parse_args(argv)
+
+    try:
+        params = parse_params(args.param)
+    except ValueError as e:
+        parser.error(str(e))
+    extension = args.extension
+    if extension and not extension.startswith("."):
+        extension = "." + extension
+
+    def progress(done, total, path, error):
+        if error or not args.quiet:
+            print_progress(done, total, path, error)
+
+    start = time.perf_counter()
+    total, failures = run_batch(args.input, args.operation, params, args.output, args.workers,
+                                args.chunksize, extension, args.skip_existing, progress)
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"Processed {total - len(failures)}/{total} images in {elapsed:.1f}s ({rate:.1f} images/s), {len(failures)} failed", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+def bytes_digest(data):
+    # SHA-1 is hardware accelerated on most hosts and only used as a cache key
+    return hashlib.sha1(data, usedforsecurity=False).hexdigest()
+
+def image_digest(image):
+    image = np.ascontiguousarray(image)
+    h = hashlib.sha1(usedforsecurity=False)
+    h.update(f"{image.shape}{image.dtype.str}".encode())
+    h.update(memoryview(image).cast("B"))
+    return h.hexdigest()
+
+def nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value) + sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values()) + sys.getsizeof(value)
+    if hasattr(value, "__dict__"):
+        # plain objects count the arrays they hold (probers, spectra, ...)
+        return nbytes(vars(value)) + sys.getsizeof(value)
+    return sys.getsizeof(value)
+
+def freeze(value):
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            freeze(v)
+    return value
+
+class LRUCache:
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=nbytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            if key in self._data:
+                self.total_bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self.total_bytes += size
+            while (self.max_entries is not None and len(self._data) > self.max_entries) or \
+                    (self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.total_bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        return {"entries": len(self._data), "bytes": self.total_bytes, "hits": self.hits, "misses": self.misses}
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+class ResultCache(LRUCache):
+    """LRU of operation results keyed by image content, operation and parameters.
+
+    Cached arrays are made read-only because the same object is handed to
+    every caller that hits the entry.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        super().__init__(max_bytes=max_bytes)
+
+    @staticmethod
+    def key(image_key, name, params):
+        return (image_key, name, tuple(sorted(params.items())))
+
+    def compute(self, func, image, name=None, image_key=None, **params):
+        key = self.key(image_key or image_digest(image), name or func.__name__, params)
+        result = self.get(key)
+        if result is None:
+            result = freeze(func(image, **params))
+            self.put(key, result)
+        return result
+
+_result_cache = None
+
+def get_result_cache(max_bytes=512 * 1024 * 1024):
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(max_bytes)
+    return _result_cache
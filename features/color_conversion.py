@@ -5,37 +5,26 @@ import matplotlib.pyplot as plt
 from PIL import Image
 import io
 
+from features.color_engine import CHANNELS, SPACES, convert, convert_all, to_uint8
+from features.image_store import get_uploaded_image
+
 def opencv_to_pil(image):
     if len(image.shape) == 2:
         return Image.fromarray(image.astype(np.uint8))
     else:
         return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
 
-def read_image(uploaded_file):
-    image_data = np.frombuffer(uploaded_file.read(), np.uint8)
-    img = cv2.imdecode(image_data, cv2.IMREAD_COLOR)
-    return img
-
 def rgb_to_yiq(rgb):
-    transform_matrix = np.array([[0.299, 0.587, 0.114],
-                                [0.59590059, -0.27455667, -0.32134392],
-                                [0.21153661, -0.52273617, 0.31119955]])
-    yiq = np.dot(rgb, transform_matrix.T)
-    yiq = (yiq - np.min(yiq)) / (np.max(yiq) - np.min(yiq))
+    """YIQ normalized to [0, 1] by the global min and max over all channels."""
+    yiq = convert(rgb, "YIQ")
+    low, high = float(yiq.min()), float(yiq.max())
+    yiq -= np.float32(low)
+    yiq /= np.float32(high - low)
     return yiq
 
 def rgb_to_hsi(rgb):
-    with np.errstate(divide='ignore', invalid='ignore'):
-        rgb = np.float32(rgb) / 255.0
-        r, g, b = cv2.split(rgb)
-        intensity = np.divide(r + g + b, 3)
-        minimum = np.minimum(np.minimum(r, g), b)
-        saturation = 1 - 3 * np.divide(minimum, r + g + b + 1e-6)
-        sqrt_calc = np.sqrt(((r - g) * (r - g)) + ((r - b) * (g - b)))
-        theta = np.arccos(0.5 * ((r - g + r - b) / (sqrt_calc + 1e-6)))
-        hue = np.where(b <= g, theta, 2 * np.pi - theta)
-        hsi = cv2.merge((hue, saturation, intensity))
-        return hsi, hue, saturation, intensity
+    hsi = convert(rgb, "HSI")
+    return hsi, hsi[:, :, 0], hsi[:, :, 1], hsi[:, :, 2]
 
 def process_color_space(img, color_space):
     image_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
@@ -55,7 +44,7 @@ def process_color_space(img, color_space):
         st.pyplot(fig)
     
     elif color_space == "XYZ":
-        image_xyz = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2XYZ)
+        image_xyz = to_uint8(convert(image_rgb, "XYZ"), "XYZ")
         st.subheader("XYZ Image")
         st.image(opencv_to_pil(image_xyz), use_column_width=True)
         X, Y, Z = cv2.split(image_xyz)
@@ -73,7 +62,7 @@ def process_color_space(img, color_space):
         st.pyplot(fig)
     
     elif color_space == "Lab":
-        image_lab = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2Lab)
+        image_lab = to_uint8(convert(image_rgb, "Lab"), "Lab")
         st.subheader("CIELab Image")
         st.image(opencv_to_pil(image_lab), use_column_width=True)
         L, a, b = cv2.split(image_lab)
@@ -91,7 +80,7 @@ def process_color_space(img, color_space):
         st.pyplot(fig)
     
     elif color_space == "YCbCr":
-        image_ycbcr = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2YCrCb)
+        image_ycbcr = to_uint8(convert(image_rgb, "YCbCr"), "YCbCr")
         st.subheader("YCbCr Image")
         st.image(opencv_to_pil(image_ycbcr), use_column_width=True)
         Y, Cb, Cr = cv2.split(image_ycbcr)
@@ -109,7 +98,7 @@ def process_color_space(img, color_space):
         st.pyplot(fig)
     
     elif color_space == "YIQ":
-        image_yiq = rgb_to_yiq(image_rgb / 255.0)
+        image_yiq = rgb_to_yiq(image_rgb)
         st.subheader("YIQ Image")
         st.image(image_yiq, use_column_width=True)
         Y, I, Q = image_yiq[:, :, 0], image_yiq[:, :, 1], image_yiq[:, :, 2]
@@ -126,7 +115,7 @@ def process_color_space(img, color_space):
         st.pyplot(fig)
     
     elif color_space == "YUV":
-        image_yuv = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2YUV)
+        image_yuv = to_uint8(convert(image_rgb, "YUV"), "YUV")
         st.subheader("YUV Image")
         st.image(opencv_to_pil(image_yuv), use_column_width=True)
         Y, U, V = cv2.split(image_yuv)
@@ -143,7 +132,8 @@ def process_color_space(img, color_space):
     elif color_space == "HSI":
         image_hsi, H, S, I = rgb_to_hsi(image_rgb)
         st.subheader("HSI Image")
-        st.image(image_hsi, use_column_width=True)
+        # hue is in radians; show every channel on 0..255
+        st.image(to_uint8(image_hsi, "HSI"), use_column_width=True)
         fig, axes = plt.subplots(1, 3, figsize=(10, 4))
         axes[0].imshow(H, cmap='hsv')
         axes[0].set_title('Hue')
@@ -155,7 +145,7 @@ def process_color_space(img, color_space):
         st.pyplot(fig)
     
     elif color_space == "Luv":
-        image_luv = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2Luv)
+        image_luv = to_uint8(convert(image_rgb, "Luv"), "Luv")
         luv_normalized = cv2.normalize(image_luv, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
         st.subheader("CIELuv Image")
         st.image(opencv_to_pil(luv_normalized), use_column_width=True)
@@ -170,13 +160,22 @@ def process_color_space(img, color_space):
         plt.tight_layout()
         st.pyplot(fig)
 
+def process_all_color_spaces(img, columns=4):
+    """Every space at once, from one ColorBundle converted on a thread pool."""
+    bundle = convert_all(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), SPACES)
+    st.subheader("All Color Spaces")
+    for start in range(0, len(SPACES), columns):
+        for column, space in zip(st.columns(columns), SPACES[start:start + columns]):
+            column.image(to_uint8(bundle[space], space), caption=f"{space} ({', '.join(CHANNELS[space])})",
+                         use_column_width=True)
+
 def main():
     st.title("Color Space Conversion with Streamlit")
     st.write("Upload an image and select a color space to view the converted image and its components.")
-    uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"])
+    stored = get_uploaded_image("Choose an image...", type=["jpg", "jpeg", "png"])
 
-    if uploaded_file is not None:
-        img = read_image(uploaded_file)
+    if stored is not None:
+        img = stored.image
         st.subheader("Original Image")
         st.image(opencv_to_pil(img), use_column_width=True)
 
@@ -185,6 +184,8 @@ def main():
         
         if st.button("Process Image"):
             process_color_space(img, color_space)
+        if st.button("Convert to All"):
+            process_all_color_spaces(img)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,341 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from features.caching import freeze
+
+SPACES = ("RGB", "XYZ", "Lab", "YCbCr", "YIQ", "YUV", "HSI", "Luv")
+CHANNELS = {
+    "RGB": ("R", "G", "B"),
+    "XYZ": ("X", "Y", "Z"),
+    "Lab": ("L", "a", "b"),
+    "YCbCr": ("Y", "Cb", "Cr"),
+    "YIQ": ("Y", "I", "Q"),
+    "YUV": ("Y", "U", "V"),
+    "HSI": ("H", "S", "I"),
+    "Luv": ("L", "u", "v"),
+}
+
+# 3x4 affine matrices on RGB in [0, 1]; the last column is the offset.
+# XYZ, YCbCr and YUV are OpenCV's float coefficients, so the results match
+# cv2.cvtColor (XYZ is taken on the gamma-encoded values, as OpenCV does).
+MATRICES = {
+    "RGB": np.array([[1, 0, 0, 0],
+                     [0, 1, 0, 0],
+                     [0, 0, 1, 0]], np.float32),
+    "XYZ": np.array([[0.412453, 0.357580, 0.180423, 0],
+                     [0.212671, 0.715160, 0.072169, 0],
+                     [0.019334, 0.119193, 0.950227, 0]], np.float32),
+    "YCbCr": np.array([[0.299, 0.587, 0.114, 0],
+                       [-0.168636, -0.331068, 0.499704, 0.5],
+                       [0.499813, -0.418531, -0.081282, 0.5]], np.float32),
+    "YIQ": np.array([[0.299, 0.587, 0.114, 0],
+                     [0.59590059, -0.27455667, -0.32134392, 0],
+                     [0.21153661, -0.52273617, 0.31119955, 0]], np.float32),
+    "YUV": np.array([[0.299, 0.587, 0.114, 0],
+                     [-0.147108, -0.288804, 0.435912, 0.5],
+                     [0.614777, -0.514799, -0.099978, 0.5]], np.float32),
+}
+# Lab and Luv start from linear light: OpenCV's float sRGB codes decode
+# through an interpolated table that is off by up to 0.2 L* and 0.4 a*
+CVT_CODES = {"Lab": cv2.COLOR_LRGB2Lab, "Luv": cv2.COLOR_LRGB2Luv}
+
+# (scale, offset) per channel mapping each space's float range onto 0..255;
+# OpenCV's own 8-bit encoding where it has one
+UINT8_ENCODING = {
+    "RGB": ((255, 255, 255), (0, 0, 0)),
+    "XYZ": ((255, 255, 255), (0, 0, 0)),
+    "Lab": ((255 / 100, 1, 1), (0, 128, 128)),
+    "YCbCr": ((255, 255, 255), (0, 0, 0)),
+    "YIQ": ((255, 255, 255), (0, 128, 128)),
+    "YUV": ((255, 255, 255), (0, 0, 0)),
+    "HSI": ((255 / (2 * np.pi), 255, 255), (0, 0, 0)),
+    "Luv": ((255 / 100, 255 / 354, 255 / 262), (0, 134 * 255 / 354, 140 * 255 / 262)),
+}
+
+def srgb_to_linear(values):
+    """sRGB-encoded values in [0, 1] to linear light, as float32."""
+    values = np.asarray(values, np.float32)
+    return np.where(values <= 0.04045, values / np.float32(12.92),
+                    ((values + np.float32(0.055)) / np.float32(1.055)) ** np.float32(2.4)).astype(np.float32)
+
+# the decoding of every 8-bit value, for cv2.LUT
+SRGB_TO_LINEAR = srgb_to_linear(np.arange(256) / 255)
+
+def check_rgb(rgb):
+    if rgb.ndim != 3 or rgb.shape[2] != 3:
+        raise ValueError(f"Expected an (H, W, 3) RGB image, got shape {rgb.shape}")
+
+def output_buffer(rgb, out=None):
+    """A float32 (H, W, 3) buffer for converting `rgb`; `out` if given."""
+    check_rgb(rgb)
+    if out is None:
+        return np.empty(rgb.shape, np.float32)
+    if out.shape != rgb.shape or out.dtype != np.float32 or not out.flags.c_contiguous:
+        raise ValueError(f"out must be a C-contiguous float32 array of shape {rgb.shape}")
+    return out
+
+def input_scale(rgb):
+    """Factor mapping `rgb` onto [0, 1]: uint8 is 0..255, floats are 0..1."""
+    if rgb.dtype == np.uint8:
+        return 1 / 255
+    if np.issubdtype(rgb.dtype, np.floating):
+        return 1.0
+    raise ValueError(f"Unsupported image dtype {rgb.dtype}")
+
+def matrix_transform(rgb, matrix, out=None):
+    """`matrix` (3x4 affine, on RGB in [0, 1]) applied with one cv2.transform.
+
+    The input is cast into `out` first and transformed in place, with the
+    8-bit scale folded into the matrix, so no other full-size array is made.
+    """
+    out = output_buffer(rgb, out)
+    scale = input_scale(rgb)
+    np.copyto(out, rgb, casting="unsafe")
+    fused = matrix.copy()
+    fused[:, :3] *= np.float32(scale)
+    return cv2.transform(out, fused, dst=out)
+
+def to_float(rgb, out=None):
+    """RGB in [0, 1] as float32."""
+    out = output_buffer(rgb, out)
+    scale = input_scale(rgb)
+    np.copyto(out, rgb, casting="unsafe")
+    if scale != 1:
+        np.multiply(out, np.float32(scale), out=out)
+    return out
+
+def to_linear(rgb, out=None):
+    """Linear-light RGB (decoded sRGB) as float32; a table lookup for uint8."""
+    out = output_buffer(rgb, out)
+    if rgb.dtype == np.uint8:
+        return cv2.LUT(rgb, SRGB_TO_LINEAR, dst=out)
+    input_scale(rgb)
+    np.copyto(out, srgb_to_linear(rgb))
+    return out
+
+def to_rgb(rgb, out=None):
+    return to_float(rgb, out)
+
+def to_xyz(rgb, out=None):
+    return matrix_transform(rgb, MATRICES["XYZ"], out)
+
+def to_ycbcr(rgb, out=None):
+    """Y in [0, 1]; Cb and Cr centered on 0.5 (channel order Y, Cb, Cr)."""
+    return matrix_transform(rgb, MATRICES["YCbCr"], out)
+
+def to_yiq(rgb, out=None):
+    """Y in [0, 1]; I in +-0.596 and Q in +-0.523, not normalized."""
+    return matrix_transform(rgb, MATRICES["YIQ"], out)
+
+def to_yuv(rgb, out=None):
+    """Y in [0, 1]; U and V centered on 0.5, as OpenCV's float YUV."""
+    return matrix_transform(rgb, MATRICES["YUV"], out)
+
+def to_lab(rgb, out=None):
+    """CIE L*a*b* (D65, sRGB): L in [0, 100], a and b in about +-127."""
+    out = to_linear(rgb, out)
+    return cv2.cvtColor(out, CVT_CODES["Lab"], dst=out)
+
+def to_luv(rgb, out=None):
+    """CIE L*u*v* (D65, sRGB): L in [0, 100], u in [-134, 220], v in [-140, 122]."""
+    out = to_linear(rgb, out)
+    return cv2.cvtColor(out, CVT_CODES["Luv"], dst=out)
+
+def to_hsi(rgb, out=None):
+    """Hue in radians [0, 2*pi), saturation and intensity in [0, 1].
+
+    `out` first holds the float input, split into three contiguous planes;
+    two more scratch planes are updated in place, and the results are
+    merged back into `out`.
+    """
+    out = to_float(rgb, out)
+    r, g, b = cv2.split(out)
+    total = r + g
+    total += b
+    minimum = np.minimum(r, g)
+    np.minimum(minimum, b, out=minimum)
+    # saturation = 1 - 3 * min / (sum + eps), intensity = sum / 3
+    saturation = np.add(total, np.float32(1e-6))
+    np.divide(minimum, saturation, out=saturation)
+    saturation *= np.float32(-3)
+    saturation += np.float32(1)
+    intensity = total
+    intensity /= np.float32(3)
+
+    # theta = arccos(((r - g) + (r - b)) / 2 / (sqrt((r - g)^2 + (r - b)(g - b)) + eps))
+    r_g = np.subtract(r, g, out=minimum)
+    r_b = np.subtract(r, b, out=r)
+    g_b = np.subtract(g, b, out=g)
+    denominator = np.multiply(r_g, r_g)
+    denominator += np.multiply(r_b, g_b, out=b)
+    np.sqrt(denominator, out=denominator)
+    denominator += np.float32(1e-6)
+    numerator = r_g
+    numerator += r_b
+    numerator *= np.float32(0.5)
+    numerator /= denominator
+    np.clip(numerator, -1, 1, out=numerator)
+    hue = np.arccos(numerator, out=numerator)
+    # b > g puts the hue in the lower half turn
+    np.subtract(np.float32(2 * np.pi), hue, out=hue, where=g_b < 0)
+    return cv2.merge((hue, saturation, intensity), dst=out)
+
+CONVERTERS = {
+    "RGB": to_rgb,
+    "XYZ": to_xyz,
+    "Lab": to_lab,
+    "YCbCr": to_ycbcr,
+    "YIQ": to_yiq,
+    "YUV": to_yuv,
+    "HSI": to_hsi,
+    "Luv": to_luv,
+}
+
+def convert(rgb, space, out=None, backend="direct"):
+    """`rgb` (uint8 0..255 or float 0..1, channels R, G, B) converted to
+    `space` as float32 (H, W, 3), written into `out` when given.
+
+    backend="lut" looks uint8 HSI up in a precomputed table
+    (features.color_lut) instead of computing it; other spaces (including
+    Lab and Luv, whose OpenCV paths are faster than a lookup) and float
+    input always take the direct path. No Streamlit and no display
+    scaling: see UINT8_ENCODING / to_uint8.
+    """
+    if space not in CONVERTERS:
+        raise ValueError(f"Unknown color space {space!r}; expected one of {', '.join(SPACES)}")
+    if backend == "lut" and rgb.dtype == np.uint8:
+        # imported here: color_lut builds its tables with this module
+        from features.color_lut import LUT_SPACES, get_color_lut
+        if space in LUT_SPACES:
+            return get_color_lut(space).convert(rgb, out)
+    elif backend not in ("direct", "lut"):
+        raise ValueError(f"Unknown backend {backend!r}; expected 'direct' or 'lut'")
+    return CONVERTERS[space](rgb, out)
+
+def to_uint8(converted, space):
+    """A converted image mapped onto 0..255 with UINT8_ENCODING[space]."""
+    scale, offset = UINT8_ENCODING[space]
+    affine = np.zeros((3, 4), np.float32)
+    affine[:, :3] = np.diag(scale)
+    affine[:, 3] = offset
+    encoded = cv2.transform(converted, affine)
+    return np.clip(np.rint(encoded, out=encoded), 0, 255, out=encoded).astype(np.uint8)
+
+class ColorBundle:
+    """All eight color spaces of one RGB image, each converted on first access.
+
+    Two intermediates are computed once and shared: the float RGB, which is
+    the RGB result itself and the input of XYZ, YCbCr, YIQ, YUV (one affine
+    transform each) and HSI, and the linear-light RGB read by Lab and Luv.
+    XYZ is not shared with Lab and Luv, since OpenCV derives those from
+    linear RGB internally. Results are read-only and agree with convert()
+    to float32 rounding. Spaces that are
+    never read cost nothing; compute() fills several at once on a thread
+    pool. backend="lut" is used as in convert().
+    """
+
+    def __init__(self, rgb, backend="direct"):
+        check_rgb(rgb)
+        input_scale(rgb)
+        if backend not in ("direct", "lut"):
+            raise ValueError(f"Unknown backend {backend!r}; expected 'direct' or 'lut'")
+        self.rgb = rgb
+        self.backend = backend
+        self._values = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, factory):
+        # one lock per value, so threads wait only for what they need
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._values:
+                self._values[key] = freeze(factory())
+            return self._values[key]
+
+    def __getitem__(self, space):
+        if space not in SPACES:
+            raise KeyError(space)
+        return self._get(space, getattr(self, f"_{space.lower()}"))
+
+    def __contains__(self, space):
+        return space in SPACES
+
+    def __iter__(self):
+        return iter(SPACES)
+
+    def __len__(self):
+        return len(SPACES)
+
+    def keys(self):
+        return SPACES
+
+    def items(self):
+        return ((space, self[space]) for space in SPACES)
+
+    @property
+    def materialized(self):
+        """Spaces converted so far."""
+        return tuple(space for space in SPACES if space in self._values)
+
+    def compute(self, spaces=SPACES, max_workers=None):
+        """Convert `spaces` now, on `max_workers` threads (default: one per
+        CPU; 1 converts in this thread). OpenCV and NumPy release the GIL."""
+        spaces = [space for space in spaces if space not in self._values]
+        workers = max(1, min(len(spaces), max_workers or os.cpu_count() or 1))
+        if workers == 1:
+            for space in spaces:
+                self[space]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(self.__getitem__, spaces))
+        return self
+
+    @property
+    def float_rgb(self):
+        return self._get("float", lambda: to_float(self.rgb))
+
+    @property
+    def linear_rgb(self):
+        return self._get("linear", lambda: to_linear(self.rgb))
+
+    def _uses_lut(self, space):
+        # imported here for the same reason as in convert()
+        from features.color_lut import LUT_SPACES
+        return self.backend == "lut" and self.rgb.dtype == np.uint8 and space in LUT_SPACES
+
+    def _rgb(self):
+        return self.float_rgb
+
+    def _xyz(self):
+        return cv2.transform(self.float_rgb, MATRICES["XYZ"])
+
+    def _hsi(self):
+        if self._uses_lut("HSI"):
+            return convert(self.rgb, "HSI", backend="lut")
+        return to_hsi(self.float_rgb)
+
+    def _ycbcr(self):
+        return cv2.transform(self.float_rgb, MATRICES["YCbCr"])
+
+    def _yiq(self):
+        return cv2.transform(self.float_rgb, MATRICES["YIQ"])
+
+    def _yuv(self):
+        return cv2.transform(self.float_rgb, MATRICES["YUV"])
+
+    def _lab(self):
+        return cv2.cvtColor(self.linear_rgb, CVT_CODES["Lab"])
+
+    def _luv(self):
+        return cv2.cvtColor(self.linear_rgb, CVT_CODES["Luv"])
+
+def convert_all(rgb, spaces=(), max_workers=None, backend="direct"):
+    """A ColorBundle of `rgb` with `spaces` converted up front (all eight
+    with spaces=SPACES); the rest convert when first read."""
+    return ColorBundle(rgb, backend).compute(spaces, max_workers)
@@ -0,0 +1,146 @@
+import os
+import sys
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+from features.color_engine import convert, output_buffer
+
+LUT_DIRECTORY = os.environ.get(
+    "IMAGE_PROCESSING_LUT_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "image_processing", "color_luts"),
+)
+# bump when a conversion or the encoding changes, so stale files are not read
+LUT_VERSION = 2
+# (low, high) per channel that the 16-bit codes cover, from the ranges the
+# conversions reach on 8-bit sRGB. Only HSI: OpenCV's Lab and Luv are table
+# driven already and about twice as fast as a gather from 128 MB, so those
+# always convert directly.
+LUT_RANGES = {
+    "HSI": ((0, 2 * np.pi), (0, 1), (0, 1)),
+}
+LUT_SPACES = tuple(LUT_RANGES)
+LEVELS = 65535
+# tables are built this many red values at a time
+BUILD_ROWS = 16
+
+def error_bound(space):
+    """Largest |LUT - direct| per channel, up to float32 rounding: half a
+    16-bit code step (5e-5 rad of hue, 8e-6 of saturation and intensity)."""
+    return np.array([(high - low) / (2 * LEVELS) for low, high in LUT_RANGES[space]])
+
+def pixel_index(rgb):
+    """R << 16 | G << 8 | B per pixel of a uint8 RGB image, as uint32."""
+    if sys.byteorder == "little":
+        # BGRA bytes read as one little-endian word are A R G B, high to low
+        index = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGRA).view(np.uint32)[..., 0]
+        index &= 0xFFFFFF
+        return index
+    index = rgb[..., 0].astype(np.uint32)
+    index <<= 8
+    index |= rgb[..., 1]
+    index <<= 8
+    index |= rgb[..., 2]
+    return index
+
+class ColorLUT:
+    """Every 8-bit RGB color converted to one space, for lookups by gather.
+
+    The table has 2^24 entries of three 16-bit codes (padded to 64 bits so
+    one gather fetches a pixel); codes cover LUT_RANGES linearly, so the
+    decoded values are within error_bound(space) of the direct conversion.
+    It is built on first use and saved under `directory` (128 MB), then
+    memory-mapped by later processes. Without a writable directory the
+    table only lives in memory. Only HSI has one (see LUT_RANGES): its
+    direct path needs sqrt and arccos per pixel.
+    """
+
+    def __init__(self, space, directory=LUT_DIRECTORY):
+        if space not in LUT_RANGES:
+            raise ValueError(f"No lookup table for {space!r}; expected one of {', '.join(LUT_SPACES)}")
+        self.space = space
+        self.path = os.path.join(directory, f"{space}-v{LUT_VERSION}.npy") if directory else None
+        low, high = np.array(LUT_RANGES[space], np.float64).T
+        self.scale = LEVELS / (high - low)
+        self.low = low
+        self.decode_matrix = np.zeros((3, 4), np.float32)
+        self.decode_matrix[:, :3] = np.diag(1 / self.scale)
+        self.decode_matrix[:, 3] = low
+        self._table = None
+        self._lock = threading.Lock()
+
+    def encode(self, converted):
+        """(..., 3) converted values as (..., 4) uint16 codes, the last zero."""
+        codes = np.zeros(converted.shape[:-1] + (4,), np.uint16)
+        scaled = (converted - self.low) * self.scale
+        codes[..., :3] = np.clip(np.rint(scaled), 0, LEVELS)
+        return codes
+
+    def build(self):
+        table = np.empty((256, 256, 256, 4), np.uint16)
+        green, blue = np.meshgrid(np.arange(256, dtype=np.uint8), np.arange(256, dtype=np.uint8), indexing="ij")
+        rgb = np.empty((BUILD_ROWS, 256, 256, 3), np.uint8)
+        rgb[..., 1], rgb[..., 2] = green, blue
+        converted = np.empty((BUILD_ROWS * 256, 256, 3), np.float32)
+        for red in range(0, 256, BUILD_ROWS):
+            rgb[..., 0] = np.arange(red, red + BUILD_ROWS, dtype=np.uint8)[:, None, None]
+            convert(rgb.reshape(-1, 256, 3), self.space, out=converted)
+            table[red:red + BUILD_ROWS] = self.encode(converted).reshape(BUILD_ROWS, 256, 256, 4)
+        return table.reshape(-1, 4).view(np.uint64).ravel()
+
+    def _save(self, table):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        # write then rename, so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".npy.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, table)
+            # mkstemp creates the file private to this user
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @property
+    def table(self):
+        with self._lock:
+            if self._table is None:
+                if self.path and os.path.exists(self.path):
+                    self._table = np.load(self.path, mmap_mode="r")
+                else:
+                    self._table = self.build()
+                    if self.path:
+                        try:
+                            self._save(self._table)
+                        except OSError:
+                            # read-only cache directory: keep the table in memory only
+                            pass
+            return self._table
+
+    def convert(self, rgb, out=None):
+        """Like color_engine.convert(rgb, self.space, out) for uint8 RGB,
+        as one gather and one fused decode."""
+        if rgb.dtype != np.uint8:
+            raise ValueError(f"Lookup tables need uint8 input, got {rgb.dtype}")
+        out = output_buffer(rgb, out)
+        height, width = rgb.shape[:2]
+        # gather into the first 8 bytes per pixel of `out` (it has 12);
+        # mode="clip" skips the buffered copy numpy makes for mode="raise"
+        codes = out.reshape(-1).view(np.uint8)[:height * width * 8].view(np.uint64)
+        np.take(self.table, pixel_index(rgb).reshape(-1), out=codes, mode="clip")
+        channels = cv2.cvtColor(codes.view(np.uint16).reshape(height, width, 4), cv2.COLOR_BGRA2BGR)
+        np.copyto(out, channels, casting="unsafe")
+        return cv2.transform(out, self.decode_matrix, dst=out)
+
+_luts = {}
+_luts_lock = threading.Lock()
+
+def get_color_lut(space):
+    with _luts_lock:
+        if space not in _luts:
+            _luts[space] = ColorLUT(space)
+        return _luts[space]
@@ -0,0 +1,454 @@
+import argparse
+import csv
+import glob
+import io
+import math
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from features.batch_processing import IMAGE_EXTENSIONS
+from features.caching import bytes_digest
+from features.image_compression import CODECS, bd_rate_summary, rate_distortion_table
+from features.results_store import configure_results_store
+
+COLUMNS = ["Path", "Hash", "Width", "Height", "Channels", "Codec", "Setting", "FileSize (KB)", "BPP",
+           "CompressionRatio", "PSNR (dB)", "SSIM", "Identical"]
+DEFAULT_CODECS = ("JPEG", "PNG")
+ROWS_PER_PART = 50000
+
+def iter_inputs(source):
+    """Yield image paths under a directory (recursively) or matching a glob, lazily."""
+    if os.path.isdir(source):
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(dirpath, name)
+    else:
+        for path in glob.iglob(source, recursive=True):
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                yield path
+
+def decode_for_analysis(data):
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError("cannot decode image")
+    if img.dtype != np.uint8:
+        raise ValueError(f"unsupported sample type {img.dtype}")
+    if img.ndim == 3 and img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    elif img.ndim == 3 and img.shape[2] == 1:
+        img = img[:, :, 0]
+    is_color = img.ndim == 3
+    return (cv2.cvtColor(img, cv2.COLOR_BGR2RGB) if is_color else img), is_color
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return bytes_digest(f.read())
+
+def _init_worker():
+    # one image per process already keeps every core busy
+    cv2.setNumThreads(1)
+    # the batch output is its own record; keep the shared store for the app
+    configure_results_store(None)
+
+def analyze_file(path, codec_names):
+    """Returns (path, rows, error)."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = bytes_digest(data)
+        img, is_color = decode_for_analysis(data)
+        table = rate_distortion_table(img, is_color, len(data), codec_names, max_workers=1)
+        height, width = img.shape[:2]
+        table.insert(0, "Path", path)
+        table.insert(1, "Hash", digest)
+        table.insert(2, "Width", width)
+        table.insert(3, "Height", height)
+        table.insert(4, "Channels", 3 if is_color else 1)
+        return path, table[COLUMNS].to_dict("records"), None
+    except Exception as e:
+        return path, [], f"{type(e).__name__}: {e}"
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (hash TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS parts (name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+class OutputIndex:
+    """Content hashes committed to a results output, in a SQLite file.
+
+    Lookups go to disk, so resuming a run over millions of images needs no
+    in-memory hash set. A hash is only inserted in the same transaction that
+    records the output position covering its rows (the CSV length, or the
+    Parquet part name), so rows written after the last commit can be
+    discarded on reopen and their images recomputed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.created = not os.path.exists(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(INDEX_SCHEMA)
+
+    def __contains__(self, digest):
+        return self.conn.execute("SELECT 1 FROM hashes WHERE hash = ?", (digest,)).fetchone() is not None
+
+    def commit(self, digests, part=None, offset=None):
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO hashes VALUES (?)", ((digest,) for digest in digests))
+            if part is not None:
+                self.conn.execute("INSERT OR IGNORE INTO parts VALUES (?)", (part,))
+            if offset is not None:
+                self.conn.execute("INSERT OR REPLACE INTO state VALUES ('offset', ?)", (offset,))
+
+    def offset(self):
+        row = self.conn.execute("SELECT value FROM state WHERE key = 'offset'").fetchone()
+        return row[0] if row else 0
+
+    def parts(self):
+        return {name for name, in self.conn.execute("SELECT name FROM parts")}
+
+    def reset(self):
+        with self.conn:
+            self.conn.executescript("DELETE FROM hashes; DELETE FROM parts; DELETE FROM state;")
+
+    def rebuild(self, output, **position):
+        """Index every hash already in `output`, e.g. one written before the index existed."""
+        self.reset()
+        for chunk in output.iter_chunks(["Hash"]):
+            self.commit(chunk["Hash"].astype(str))
+        self.commit((), **position)
+
+    def close(self):
+        self.conn.close()
+
+class CsvOutput:
+    """Appends rows to one CSV file, committed image by image.
+
+    Each image's rows go out in a single write, then the file length is
+    committed to the index together with the image hash. On reopen the file
+    is truncated back to the committed length, dropping the rows of an
+    image whose run died part way.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.index = OutputIndex(path + ".index.sqlite3")
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if self.index.created or size < self.index.offset():
+            # no index yet, or the CSV was replaced behind its back
+            self.index.rebuild(self, offset=size)
+        elif size > self.index.offset():
+            with open(path, "r+b") as f:
+                f.truncate(self.index.offset())
+        self.file = open(path, "a", newline="")
+        self.writer = csv.DictWriter(self.file, COLUMNS)
+        if self.file.tell() == 0:
+            self.writer.writeheader()
+            self.file.flush()
+            self.index.commit((), offset=self.file.tell())
+
+    def __contains__(self, digest):
+        return digest in self.index
+
+    def write(self, digest, rows):
+        text = io.StringIO(newline="")
+        csv.DictWriter(text, COLUMNS).writerows(rows)
+        self.file.write(text.getvalue())
+        self.file.flush()
+        self.index.commit([digest], offset=self.file.tell())
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+    def iter_chunks(self, columns):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        yield from pd.read_csv(self.path, usecols=columns, chunksize=ROWS_PER_PART)
+
+class ParquetOutput:
+    """Writes rows as numbered part files in a directory.
+
+    Parquet files cannot be appended to, so rows are buffered up to
+    `rows_per_part` and each part is written atomically (temp + rename),
+    then committed to the index with the hashes of its images. A part left
+    uncommitted by a crash is deleted on reopen, and rows still buffered
+    when the run dies are recomputed on resume.
+    """
+
+    def __init__(self, path, rows_per_part=ROWS_PER_PART):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow)") from None
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self.buffer = []
+        self.buffered_hashes = set()
+        os.makedirs(path, exist_ok=True)
+        self.index = OutputIndex(os.path.join(path, "index.sqlite3"))
+        names = {os.path.basename(part) for part in self.parts()}
+        committed = self.index.parts()
+        if self.index.created or not committed <= names:
+            self.index.rebuild(self)
+            for name in names:
+                self.index.commit((), part=name)
+        else:
+            for name in names - committed:
+                os.unlink(os.path.join(path, name))
+        self.next_part = len(self.parts())
+
+    def parts(self):
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path)
+                      if name.startswith("part-") and name.endswith(".parquet"))
+
+    def __contains__(self, digest):
+        return digest in self.buffered_hashes or digest in self.index
+
+    def write(self, digest, rows):
+        self.buffer.extend(rows)
+        self.buffered_hashes.add(digest)
+        if len(self.buffer) >= self.rows_per_part:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        frame = pd.DataFrame(self.buffer, columns=COLUMNS)
+        # Setting mixes ints and codec-specific values across codecs
+        frame["Setting"] = frame["Setting"].astype(str)
+        target = os.path.join(self.path, f"part-{self.next_part:05d}.parquet")
+        temp = target + ".tmp"
+        self.pq.write_table(self.pa.Table.from_pandas(frame, preserve_index=False), temp)
+        os.replace(temp, target)
+        self.index.commit(self.buffered_hashes, part=os.path.basename(target))
+        self.next_part += 1
+        self.buffer = []
+        self.buffered_hashes = set()
+
+    def close(self):
+        self.flush()
+        self.index.close()
+
+    def iter_chunks(self, columns):
+        for part in self.parts():
+            for batch in self.pq.ParquetFile(part).iter_batches(batch_size=ROWS_PER_PART, columns=columns):
+                yield batch.to_pandas()
+
+def open_output(path):
+    if path.endswith(".parquet"):
+        return ParquetOutput(path)
+    return CsvOutput(path)
+
+class RateDistortionAggregate:
+    """Running per-codec, per-setting means over any number of rows."""
+
+    def __init__(self):
+        self.sums = {}
+
+    def add(self, frame):
+        psnr = pd.to_numeric(frame["PSNR (dB)"], errors="coerce")
+        frame = frame.assign(**{
+            "Setting": frame["Setting"].astype(str),
+            "Finite PSNR": psnr.where(np.isfinite(psnr)),
+            "Lossless": frame["Identical"].astype(str).str.lower() == "true",
+        })
+        grouped = frame.groupby(["Codec", "Setting"], sort=False).agg(
+            images=("Hash", "size"),
+            size=("FileSize (KB)", "sum"),
+            bpp=("BPP", "sum"),
+            psnr=("Finite PSNR", "sum"),
+            psnr_count=("Finite PSNR", "count"),
+            ssim=("SSIM", "sum"),
+            ssim_count=("SSIM", "count"),
+            lossless=("Lossless", "sum"),
+        )
+        for key, values in grouped.iterrows():
+            totals = self.sums.setdefault(key, dict.fromkeys(values.index, 0.0))
+            for name, value in values.items():
+                totals[name] += value
+
+    def table(self):
+        rows = []
+        for (codec, setting), totals in self.sums.items():
+            images = totals["images"]
+            rows.append({
+                "Codec": codec,
+                "Setting": setting,
+                "Images": int(images),
+                "FileSize (KB)": totals["size"] / images,
+                "BPP": totals["bpp"] / images,
+                # lossless-only settings have no finite PSNR to average
+                "PSNR (dB)": totals["psnr"] / totals["psnr_count"] if totals["psnr_count"] else math.inf,
+                "SSIM": totals["ssim"] / totals["ssim_count"] if totals["ssim_count"] else None,
+                "Lossless": int(totals["lossless"]),
+            })
+        return pd.DataFrame(rows, columns=["Codec", "Setting", "Images", "FileSize (KB)", "BPP",
+                                           "PSNR (dB)", "SSIM", "Lossless"])
+
+def aggregate_output(path):
+    """Mean rate-distortion curves of a results file, read chunk by chunk."""
+    aggregate = RateDistortionAggregate()
+    output = open_output(path)
+    try:
+        for chunk in output.iter_chunks(["Hash", "Codec", "Setting", "FileSize (KB)", "BPP", "PSNR (dB)", "SSIM", "Identical"]):
+            aggregate.add(chunk)
+    finally:
+        output.close()
+    return aggregate.table()
+
+def run_corpus(source, output_path, codec_names=DEFAULT_CODECS, workers=None, max_in_flight=None, progress=None):
+    """Analyse every image under `source`, appending rows to `output_path`.
+
+    Files are streamed into a process pool with at most `max_in_flight`
+    jobs outstanding, so memory does not grow with the corpus. Before a
+    file is submitted its content hash is looked up in the output's on-disk
+    index and already committed images are skipped, which makes an
+    interrupted run resumable. Returns (processed, skipped, failures).
+    """
+    unknown = [name for name in codec_names if name not in CODECS]
+    if unknown:
+        raise ValueError(f"Unknown codec(s): {', '.join(unknown)}. Choose from: {', '.join(CODECS)}")
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    output = open_output(output_path)
+    processed = skipped = 0
+    failures = []
+
+    def report(path, error=None, was_skipped=False):
+        if progress is not None:
+            progress(processed + skipped + len(failures), path, error, was_skipped)
+
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+            pending = set()
+            paths = iter_inputs(source)
+            exhausted = False
+            try:
+                while pending or not exhausted:
+                    while not exhausted and len(pending) < max_in_flight:
+                        path = next(paths, None)
+                        if path is None:
+                            exhausted = True
+                            continue
+                        try:
+                            digest = file_digest(path)
+                        except OSError as e:
+                            failures.append((path, f"{type(e).__name__}: {e}"))
+                            report(path, failures[-1][1])
+                            continue
+                        if digest in output:
+                            skipped += 1
+                            report(path, was_skipped=True)
+                        else:
+                            pending.add(pool.submit(analyze_file, path, tuple(codec_names)))
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path, rows, error = future.result()
+                        if error is not None:
+                            failures.append((path, error))
+                            report(path, error)
+                        elif rows[0]["Hash"] in output:
+                            # same content under another path, finished first
+                            skipped += 1
+                            report(path, was_skipped=True)
+                        else:
+                            output.write(rows[0]["Hash"], rows)
+                            processed += 1
+                            report(path)
+            except KeyboardInterrupt:
+                for future in pending:
+                    future.cancel()
+                raise
+    finally:
+        output.close()
+    return processed, skipped, failures
+
+def plot_rate_distortion(table, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, 2, figsize=(14, 5))
+    for codec, group in table.groupby("Codec", sort=False):
+        lossy = np.isfinite(group["PSNR (dB)"])
+        axes[0].plot(group["BPP"][lossy], group["PSNR (dB)"][lossy], marker="o", label=codec)
+        axes[1].plot(group["BPP"], group["SSIM"], marker="o", label=codec)
+    axes[0].set_ylabel("Mean PSNR (dB)")
+    axes[1].set_ylabel("Mean SSIM")
+    for ax in axes:
+        ax.set_xlabel("Mean bits per pixel")
+        ax.set_xscale("log")
+        ax.grid(True)
+    axes[1].legend(loc="lower right")
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the compression metric pipeline over an image corpus.")
+    parser.add_argument("input", help="Input directory (searched recursively) or glob pattern")
+    parser.add_argument("output", help="Results file: .csv, or a .parquet directory of part files")
+    parser.add_argument("-c", "--codecs", default=",".join(DEFAULT_CODECS),
+                        help="Comma-separated codecs from: " + ", ".join(CODECS))
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Images queued or running at once (default: 2 x workers)")
+    parser.add_argument("--rd-output", default=None, help="Aggregate rate-distortion CSV (default: <output>_rd.csv)")
+    parser.add_argument("--plot", default=None, help="Also save the aggregate rate-distortion curves as an image")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only report failures and the summary")
+    args = parser.parse_args(argv)
+
+    codec_names = [name for name in args.codecs.split(",") if name]
+    unknown = [name for name in codec_names if name not in CODECS]
+    if unknown:
+        parser.error(f"Unknown codec(s): {', '.join(unknown)}")
+
+    def progress(done, path, error, skipped):
+        if error:
+            print(f"[{done}] {path}: FAILED {error}", file=sys.stderr, flush=True)
+        elif not args.quiet:
+            print(f"[{done}] {path}: {'skipped' if skipped else 'ok'}", file=sys.stderr, flush=True)
+
+    start = time.perf_counter()
+    try:
+        processed, skipped, failures = run_corpus(args.input, args.output, codec_names, args.workers,
+                                                  args.max_in_flight, progress)
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume.", file=sys.stderr)
+        return 130
+    except RuntimeError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    elapsed = time.perf_counter() - start
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"Analysed {processed} images in {elapsed:.1f}s ({rate:.1f} images/s), "
+          f"{skipped} already done, {len(failures)} failed", file=sys.stderr)
+
+    table = aggregate_output(args.output)
+    rd_output = args.rd_output or os.path.splitext(args.output.rstrip(os.sep))[0] + "_rd.csv"
+    table.to_csv(rd_output, index=False)
+    print(table.to_string(index=False))
+    anchor = "JPEG" if "JPEG" in codec_names else codec_names[0]
+    print(f"\nBD-rate vs {anchor} on the mean curves:")
+    print(bd_rate_summary(table, anchor).to_string(index=False))
+    if args.plot:
+        plot_rate_distortion(table, args.plot)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
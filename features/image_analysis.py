@@ -3,6 +3,16 @@ import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 
+from features.image_store import get_uploaded_image
+from features.proxy import canny_threshold_scale, choose_proxy, encode_png, scaled_gaussian_blur
+
+def load_gray(image):
+    if isinstance(image, str):
+        return cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
 def generate_freeman_chain_code(contour):
     chain_code = []
     if len(contour) < 2:
@@ -23,10 +33,16 @@ def generate_freeman_chain_code(contour):
             chain_code.append(code)
     return chain_code
 
-def process_edge_detection(img, low_threshold, high_threshold):
+def detect_edges(img, low_threshold, high_threshold, scale=1.0):
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    edges = cv2.Canny(blurred, low_threshold, high_threshold)
+    blurred = scaled_gaussian_blur(gray, 5, scale)
+    # thresholds are set for full-resolution gradients
+    gain = canny_threshold_scale(scale)
+    edges = cv2.Canny(blurred, low_threshold * gain, high_threshold * gain)
+    return blurred, edges
+
+def process_edge_detection(img, low_threshold, high_threshold, scale=1.0):
+    blurred, edges = detect_edges(img, low_threshold, high_threshold, scale)
     
     fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(15, 5))
     ax1.imshow(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
@@ -44,8 +60,8 @@ def process_edge_detection(img, low_threshold, high_threshold):
     plt.tight_layout()
     return fig
 
-def process_freeman_chain(img_path):
-    gray = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+def process_freeman_chain(image):
+    gray = load_gray(image)
     _, binary_img = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
     contours, _ = cv2.findContours(binary_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
     
@@ -99,8 +115,8 @@ def process_freeman_chain(img_path):
     
     return fig
 
-def process_integral_projection(img_path):
-    gray = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+def process_integral_projection(image):
+    gray = load_gray(image)
     _, binary_img = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
     binary_norm = binary_img / 255.0
     horizontal_projection = np.sum(binary_norm, axis=0)
@@ -138,27 +154,36 @@ def process_integral_projection(img_path):
 def main():
     st.title("Image Processing Analysis")
     st.write("Upload an image to perform Edge Detection, Freeman Chain Code Analysis, and Integral Projection.")
-    uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "png"])
+    stored = get_uploaded_image("Choose an image...", type=["jpg", "png"])
 
-    if uploaded_file is not None:
-        file_bytes = np.asarray(bytearray(uploaded_file.read()), dtype=np.uint8)
-        img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-        
-        temp_img_path = "temp_image.png"
-        cv2.imwrite(temp_img_path, img)
+    if stored is not None:
+        img = stored.image
         
         st.header("Edge Detection")
         low_threshold = st.slider("Low Threshold", 0, 255, 50)
         high_threshold = st.slider("High Threshold", 0, 255, 150)
-        edge_fig = process_edge_detection(img, low_threshold, high_threshold)
-        st.pyplot(edge_fig)
+        preview = st.checkbox("Preview mode (process at display resolution while adjusting)")
+        if preview:
+            proxy, scale = choose_proxy(stored)
+            edge_fig = process_edge_detection(proxy, low_threshold, high_threshold, scale)
+            st.pyplot(edge_fig)
+            st.caption(f"Approximate preview at {proxy.shape[1]}x{proxy.shape[0]}: thresholds are scaled "
+                       f"x{canny_threshold_scale(scale):.2f} to match sharp edges at full resolution, "
+                       "but fine texture and soft gradients can still differ.")
+            if st.button("Render full resolution"):
+                _, edges = detect_edges(img, low_threshold, high_threshold)
+                st.image(edges, caption=f"Canny edges at full resolution ({img.shape[1]}x{img.shape[0]})", use_column_width=True)
+                st.download_button("Download edges", encode_png(edges), file_name=f"{stored.base_name}_edges.png", mime="image/png")
+        else:
+            edge_fig = process_edge_detection(img, low_threshold, high_threshold)
+            st.pyplot(edge_fig)
         
         st.header("Freeman Chain Code Analysis")
-        freeman_fig = process_freeman_chain(temp_img_path)
+        freeman_fig = process_freeman_chain(img)
         st.pyplot(freeman_fig)
         
         st.header("Integral Projection Analysis")
-        proj_fig = process_integral_projection(temp_img_path)
+        proj_fig = process_integral_projection(img)
         st.pyplot(proj_fig)
 
 if __name__ == "__main__":
@@ -2,332 +2,849 @@ import streamlit as st
 import cv2
 import os
 import numpy as np
-from skimage.metrics import structural_similarity as ssim
-import matplotlib.pyplot as plt
 import pandas as pd
 from PIL import Image
 import io
-import tempfile
-import subprocess
-
-@st.cache_data
-def process_jpeg_compression(img, is_color, original_size_bytes, output_dir, base_filename):
-    jpeg_qualities = [95, 75, 50, 25, 10]
-    results = []
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from features.caching import LRUCache, image_digest
+from features.image_store import decode_image, get_uploaded_image
+from features.jpeg_model import JpegSizeModel
+from features.png_optimizer import DEFAULT_LEVEL, DEFAULT_TIMEOUT, INCOMPLETE, get_png_optimizer
+from features.quality_maps import TILE_SIZES, TileQualityReference, heatmap_overlay, tile_statistics, worst_tiles
+from features.results_store import get_results_store
+from features.sampled_compression import DEFAULT_SAMPLES, DEFAULT_TILE, DEFAULT_TOLERANCE, TileSample, estimate_compression, validation_table
+from features.ssim_engine import SSIMReference
+
+JPEG_QUALITIES = [95, 75, 50, 25, 10]
+# about a third of the page width (proxy.PREVIEW_WIDTH), for the comparison rows
+THUMBNAIL_WIDTH = 400
+PNG_LEVELS = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+# bump when the metric pipeline changes so stored rows are recomputed
+RESULTS_VERSION = 2
+# above this many pixels the page starts in sampled-estimate mode
+LARGE_IMAGE_PIXELS = 24_000_000
+
+def sweep_workers(n_settings, max_workers=None):
+    return max(1, min(n_settings, max_workers or os.cpu_count() or 1))
+
+def run_sweep(evaluate, settings, max_workers=None):
+    # encode/decode, PSNR and SSIM release the GIL, so threads overlap the
+    # levels without copying the image into other processes; map() keeps
+    # the results in the order of `settings`; failed settings are dropped
+    with ThreadPoolExecutor(max_workers=sweep_workers(len(settings), max_workers)) as pool:
+        results = list(pool.map(evaluate, settings))
+    return [(setting, result) for setting, result in zip(settings, results) if result is not None]
+
+def with_ratio(row, original_size_bytes):
+    # the ratio depends on the uploaded file, not the pixels the row is keyed by
+    size_bytes = row['FileSize (KB)'] * 1024
+    row['CompressionRatio'] = original_size_bytes / size_bytes if size_bytes > 0 else float('inf')
+    return row
+
+def stored_sweep(img, is_color, original_size_bytes, namespace, evaluate, settings, options=None, max_workers=None,
+                 storable=None):
+    """run_sweep backed by the persistent results store.
+
+    Settings already measured on these pixels (with the same `options`) are
+    read back; only the rest are evaluated, with one shared SSIM reference,
+    and saved, except rows `storable(row)` rejects. Returns ([(setting, row)], {setting: (data, decoded)}) where
+    the second part only holds the freshly encoded settings.
+    """
+    store = get_results_store()
+    keys = [dict(options or {}, setting=setting, version=RESULTS_VERSION) for setting in settings]
+    if store is not None:
+        image_hash = image_digest(img)
+        stored = store.get_many(image_hash, namespace, keys)
+    else:
+        stored = [None] * len(settings)
+    rows = {setting: with_ratio(row, original_size_bytes) for setting, row in zip(settings, stored) if row is not None}
+    missing = [setting for setting, row in zip(settings, stored) if row is None]
+
+    fresh = {}
+    if missing:
+        evaluated = run_sweep(partial(evaluate, reference=ssim_reference(img, is_color)), missing, max_workers)
+        for setting, (row, data, decoded) in evaluated:
+            rows[setting] = row
+            fresh[setting] = (data, decoded)
+        if store is not None:
+            key_for = dict(zip(settings, keys))
+            store.put_many(image_hash, namespace, [
+                (key_for[setting], row, row['FileSize (KB)'] * 1024) for setting, (row, _, _) in evaluated
+                if storable is None or storable(row)])
+    return [(setting, rows[setting]) for setting in settings if setting in rows], fresh
+
+def ssim_win_size(img):
     min_dim = min(img.shape[:2])
     win_size = min(7, min_dim if min_dim % 2 == 1 else min_dim - 1)
     if win_size < 3:
         win_size = 3
+    return win_size
+
+def ssim_reference(img, is_color):
+    # same window and data range the page always used with skimage
+    try:
+        return SSIMReference(img, data_range=img.max() - img.min(), win_size=ssim_win_size(img),
+                             channel_axis=2 if is_color else None)
+    except ValueError:
+        return None
+
+def compute_ssim(reference, other):
+    return reference.ssim(other) if reference is not None else None
+
+def encode_image(img, is_color, ext, params):
+    img_to_save = cv2.cvtColor(img, cv2.COLOR_RGB2BGR) if is_color else img
+    ok, buffer = cv2.imencode(ext, img_to_save, params)
+    return buffer.tobytes() if ok else None
+
+def decode_encoded(data, is_color):
+    decoded = decode_image(data, cv2.IMREAD_COLOR if is_color else cv2.IMREAD_GRAYSCALE)
+    if decoded is None:
+        return None
+    return cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB) if is_color else decoded
+
+def zip_files(files):
+    buffer = io.BytesIO()
+    # JPEG/PNG payloads are already compressed
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for filename, data in files.items():
+            archive.writestr(filename, data)
+    return buffer.getvalue()
+
+def evaluate_jpeg_quality(img, is_color, original_size_bytes, quality, reference=None):
+    data = encode_image(img, is_color, '.jpg', [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if data is None:
+        return None
+    compressed_size_bytes = len(data)
+
+    img_compressed_cv = decode_encoded(data, is_color)
+    if img_compressed_cv is None:
+        return None
+
+    if img.shape != img_compressed_cv.shape:
+        return None
+
+    psnr_value = cv2.PSNR(img, img_compressed_cv)
+    if reference is None:
+        reference = ssim_reference(img, is_color)
+    ssim_value = compute_ssim(reference, img_compressed_cv)
+
+    identical = np.array_equal(img, img_compressed_cv)
+    row = {
+        'Method': 'JPEG',
+        'Quality': quality,
+        'FileSize (KB)': compressed_size_bytes / 1024,
+        'FileSize Opt (KB)': compressed_size_bytes / 1024,
+        'CompressionRatio': original_size_bytes / compressed_size_bytes if compressed_size_bytes > 0 else float('inf'),
+        'PSNR (dB)': psnr_value,
+        'PSNR Manual': float('inf') if identical else psnr_value,
+        'SSIM': ssim_value,
+        'Identical': identical
+    }
+    return row, data, img_compressed_cv
+
+def thumbnail(image, width=THUMBNAIL_WIDTH):
+    height, full_width = image.shape[:2]
+    if full_width <= width:
+        return np.ascontiguousarray(image)
+    size = (width, max(1, round(height * width / full_width)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+def jpeg_preview(img, is_color, quality, fresh):
+    if quality in fresh:
+        data, decoded = fresh[quality]
+        return len(data), decoded
+    data = encode_image(img, is_color, '.jpg', [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return len(data), decode_encoded(data, is_color)
 
-    os.makedirs(output_dir, exist_ok=True)
-
-    for quality in jpeg_qualities:
-        jpeg_filename = f'{base_filename}_jpeg_{quality}.jpg'
-        jpeg_path = os.path.join(output_dir, jpeg_filename)
-        
-        img_to_save = cv2.cvtColor(img, cv2.COLOR_RGB2BGR) if is_color else img
-        cv2.imwrite(jpeg_path, img_to_save, [cv2.IMWRITE_JPEG_QUALITY, quality])
-        compressed_size_bytes = os.path.getsize(jpeg_path)
-
-        img_compressed_bgr = cv2.imread(jpeg_path)
-        if img_compressed_bgr is None:
-            continue
-
-        img_compressed_cv = cv2.cvtColor(img_compressed_bgr, cv2.COLOR_BGR2RGB) if is_color else cv2.imread(jpeg_path, cv2.IMREAD_GRAYSCALE)
-        if img_compressed_cv is None:
-            continue
-
-        if img.shape != img_compressed_cv.shape:
-            continue
-
-        psnr_value = cv2.PSNR(img, img_compressed_cv)
-        try:
-            ssim_value = ssim(
-                img, img_compressed_cv,
-                channel_axis=2 if is_color else None,
-                win_size=win_size,
-                data_range=img.max() - img.min()
-            )
-        except ValueError:
-            ssim_value = None
-
-        identical = np.array_equal(img, img_compressed_cv)
-        results.append({
-            'Method': 'JPEG',
-            'Quality': quality,
-            'FileSize (KB)': compressed_size_bytes / 1024,
-            'FileSize Opt (KB)': compressed_size_bytes / 1024,
-            'CompressionRatio': original_size_bytes / compressed_size_bytes if compressed_size_bytes > 0 else float('inf'),
-            'PSNR (dB)': psnr_value,
-            'PSNR Manual': float('inf') if identical else psnr_value,
-            'SSIM': ssim_value,
-            'Identical': identical
-        })
-
-    df_results = pd.DataFrame(results)
-    
-    cmap_val = None if is_color else 'gray'
-    
-    fig, axes = plt.subplots(1, 3, figsize=(15, 5))
-    axes[0].imshow(img, cmap=cmap_val)
-    axes[0].set_title(f'Original ({original_size_bytes / 1024:.2f} KB)')
-    axes[0].axis('off')
-
-    img_q95_path = os.path.join(output_dir, f'{base_filename}_jpeg_95.jpg')
-    img_q95_bgr = cv2.imread(img_q95_path)
-    if img_q95_bgr is not None:
-        img_q95_vis = cv2.cvtColor(img_q95_bgr, cv2.COLOR_BGR2RGB) if is_color else cv2.imread(img_q95_path, cv2.IMREAD_GRAYSCALE)
-        q95_size = os.path.getsize(img_q95_path)
-        axes[1].imshow(img_q95_vis, cmap=cmap_val)
-        axes[1].set_title(f'JPEG Q95 ({q95_size / 1024:.2f} KB)')
-    else:
-        axes[1].set_title('JPEG Q95 (Error)')
-    axes[1].axis('off')
-
-    img_q10_path = os.path.join(output_dir, f'{base_filename}_jpeg_10.jpg')
-    img_q10_bgr = cv2.imread(img_q10_path)
-    if img_q10_bgr is not None:
-        img_q10_vis = cv2.cvtColor(img_q10_bgr, cv2.COLOR_BGR2RGB) if is_color else cv2.imread(img_q10_path, cv2.IMREAD_GRAYSCALE)
-        q10_size = os.path.getsize(img_q10_path)
-        axes[2].imshow(img_q10_vis, cmap=cmap_val)
-        axes[2].set_title(f'JPEG Q10 ({q10_size / 1024:.2f} KB)')
-    else:
-        axes[2].set_title('JPEG Q10 (Error)')
-    axes[2].axis('off')
-
-    plt.tight_layout()
-    
-    graf_dir = os.path.join(output_dir, 'grafik')
-    os.makedirs(graf_dir, exist_ok=True)
-    
-    fig1, ax1 = plt.subplots(figsize=(10, 6))
-    ax1.set_xlabel('JPEG Quality')
-    ax1.set_ylabel('File Size (KB)', color='tab:blue')
-    ax1.plot(df_results['Quality'], df_results['FileSize (KB)'], marker='o', label='File Size', color='tab:blue')
-    ax1.tick_params(axis='y', labelcolor='tab:blue')
-    
-    ax2 = ax1.twinx()
-    ax2.set_ylabel('PSNR / SSIM', color='tab:green')
-    ax2.plot(df_results['Quality'], df_results['PSNR (dB)'], marker='s', label='PSNR', color='tab:green')
-    ax2.plot(df_results['Quality'], df_results['SSIM'], marker='^', label='SSIM', color='tab:red')
-    ax2.tick_params(axis='y', labelcolor='tab:green')
-    
-    lines1, labels1 = ax1.get_legend_handles_labels()
-    lines2, labels2 = ax2.get_legend_handles_labels()
-    ax1.legend(lines1 + lines2, labels1 + labels2, loc='upper right')
-    plt.title('JPEG Quality vs File Size, PSNR, and SSIM')
-    plt.grid(True)
-    
-    labels = ['Original'] + [f'JPEG Q{q}' for q in df_results['Quality']]
-    file_sizes_kb = [original_size_bytes / 1024] + df_results['FileSize (KB)'].tolist()
-    
-    fig2, ax3 = plt.subplots(figsize=(10, 6))
-    bars = ax3.bar(labels, file_sizes_kb, color='skyblue')
-    ax3.set_ylabel('File Size (KB)')
-    ax3.set_title('File Size Comparison: Original vs JPEG')
-    ax3.set_xticklabels(labels, rotation=45, ha='right')
-    
-    for bar in bars:
-        height = bar.get_height()
-        ax3.annotate(f'{height:.1f}', xy=(bar.get_x() + bar.get_width() / 2, height),
-                     xytext=(0, 3), textcoords="offset points", ha='center', va='bottom')
-    
-    plt.tight_layout()
-    
-    return df_results, fig, fig1, fig2
+@st.cache_data
+def process_jpeg_compression(image_key, _img, is_color, original_size_bytes, max_workers=None):
+    """JPEG sweep results: the metrics table and {label: (thumbnail, KB)}
+    for the original and the Q95/Q10 files. Only data is cached; the page
+    draws the charts.
+
+    Cached by `image_key` (the upload's key) rather than the pixels, so the
+    results store lookup is the only pass that hashes the image.
+    """
+    img = _img
+    evaluated, fresh = stored_sweep(
+        img, is_color, original_size_bytes, 'JPEG',
+        partial(evaluate_jpeg_quality, img, is_color, original_size_bytes),
+        JPEG_QUALITIES, max_workers=max_workers
+    )
+    df_results = pd.DataFrame([row for _, row in evaluated])
+
+    thumbnails = {'Original': (thumbnail(img), original_size_bytes / 1024)}
+    for quality, _ in evaluated:
+        if quality in (95, 10):
+            size, image = jpeg_preview(img, is_color, quality, fresh)
+            thumbnails[f'JPEG Q{quality}'] = (thumbnail(image), size / 1024)
+    return df_results, thumbnails
+
+def jpeg_quality_maps(img, is_color, reference, quality):
+    data = encode_image(img, is_color, '.jpg', [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return reference.maps(decode_encoded(data, is_color))
 
 @st.cache_data
-def process_png_compression(img, is_color, original_size_bytes, output_dir, base_filename):
-    png_compression_levels = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
-    results = []
-    min_dim = min(img.shape[:2])
-    win_size = min(7, min_dim if min_dim % 2 == 1 else min_dim - 1)
-    if win_size < 3:
-        win_size = 3
+def process_quality_maps(img, is_color, tile=8, max_workers=None):
+    """{quality: (psnr_map, ssim_map)} per tile for every JPEG_QUALITIES
+    level. The reference's tile statistics are shared by all levels."""
+    reference = TileQualityReference(img, tile)
+    return dict(run_sweep(partial(jpeg_quality_maps, img, is_color, reference), JPEG_QUALITIES, max_workers))
+
+def optimize_png(data, optipng_level, group=None):
+    """(bytes, optipng status); an optipng_level of None skips optipng."""
+    if optipng_level is None:
+        return data, 'unoptimized'
+    return get_png_optimizer().optimize(data, optipng_level, group)
+
+def evaluate_png_level(img, is_color, original_size_bytes, level, reference=None, optipng_level=DEFAULT_LEVEL, group=None):
+    data = encode_image(img, is_color, '.png', [cv2.IMWRITE_PNG_COMPRESSION, level])
+    if data is None:
+        return None
+    png_size_bytes = len(data)
+
+    optimized, optipng_status = optimize_png(data, optipng_level, group)
+    png_size_bytes_opt = len(optimized)
+
+    # PNG is lossless, so the optimized file decodes to the same pixels
+    img_png_compressed_cv = decode_encoded(data, is_color)
+    if img_png_compressed_cv is None:
+        return None
+
+    psnr_png = cv2.PSNR(img, img_png_compressed_cv)
+    mse = np.mean((img.astype(float) - img_png_compressed_cv.astype(float)) ** 2)
+    psnr_manual = float('inf') if mse == 0 else 20 * np.log10(255.0 / np.sqrt(mse))
+
+    if reference is None:
+        reference = ssim_reference(img, is_color)
+    ssim_png = compute_ssim(reference, img_png_compressed_cv)
+
+    is_identical = np.array_equal(img, img_png_compressed_cv)
+    row = {
+        'Method': f'PNG (Level {level})',
+        'Quality': 'Lossless',
+        'FileSize (KB)': png_size_bytes / 1024,
+        'FileSize Opt (KB)': png_size_bytes_opt / 1024,
+        'optipng': optipng_status,
+        'CompressionRatio': original_size_bytes / png_size_bytes if png_size_bytes > 0 else float('inf'),
+        'PSNR (dB)': psnr_png if psnr_png != float('inf') else 'Infinity',
+        'PSNR Manual': psnr_manual if psnr_manual != float('inf') else 'Infinity',
+        'SSIM': ssim_png,
+        'Identical': is_identical
+    }
+    return row, optimized, img_png_compressed_cv
 
-    os.makedirs(output_dir, exist_ok=True)
-
-    for level in png_compression_levels:
-        png_filename = f'{base_filename}_compressed_level{level}.png'
-        png_path = os.path.join(output_dir, png_filename)
-        
-        img_to_save = cv2.cvtColor(img, cv2.COLOR_RGB2BGR) if is_color else img
-        cv2.imwrite(png_path, img_to_save, [cv2.IMWRITE_PNG_COMPRESSION, level])
-        png_size_bytes = os.path.getsize(png_path)
-        
-        try:
-            subprocess.run(['optipng', '-o7', png_path], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            png_size_bytes_opt = os.path.getsize(png_path)
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            png_size_bytes_opt = png_size_bytes
-
-        img_png_compressed_bgr = cv2.imread(png_path)
-        if img_png_compressed_bgr is None:
-            continue
-
-        img_png_compressed_cv = cv2.cvtColor(img_png_compressed_bgr, cv2.COLOR_BGR2RGB) if is_color else cv2.imread(png_path, cv2.IMREAD_GRAYSCALE)
-        if img_png_compressed_cv is None:
-            continue
-
-        psnr_png = cv2.PSNR(img, img_png_compressed_cv)
-        mse = np.mean((img.astype(float) - img_png_compressed_cv.astype(float)) ** 2)
-        psnr_manual = float('inf') if mse == 0 else 20 * np.log10(255.0 / np.sqrt(mse))
-
-        try:
-            ssim_png = ssim(
-                img, img_png_compressed_cv,
-                channel_axis=2 if is_color else None,
-                win_size=win_size,
-                data_range=img.max() - img.min()
-            )
-        except ValueError:
-            ssim_png = None
-
-        is_identical = np.array_equal(img, img_png_compressed_cv)
-        results.append({
-            'Method': f'PNG (Level {level})',
-            'Quality': 'Lossless',
-            'FileSize (KB)': png_size_bytes / 1024,
-            'FileSize Opt (KB)': png_size_bytes_opt / 1024,
-            'CompressionRatio': original_size_bytes / png_size_bytes if png_size_bytes > 0 else float('inf'),
-            'PSNR (dB)': psnr_png if psnr_png != float('inf') else 'Infinity',
-            'PSNR Manual': psnr_manual if psnr_manual != float('inf') else 'Infinity',
-            'SSIM': ssim_png,
-            'Identical': is_identical
-        })
-
-    df_results = pd.DataFrame(results)
-    df_png = df_results[df_results['Method'].str.contains('PNG')].copy()
-    df_png['Level'] = df_png['Method'].str.extract(r'Level (\d)').astype(int)
-    df_png.sort_values('Level', inplace=True)
-
-    cmap_val = None if is_color else 'gray'
-
-    fig, axes = plt.subplots(1, 2, figsize=(10, 5))
-    axes[0].imshow(img, cmap=cmap_val)
-    axes[0].set_title(f'Original ({original_size_bytes / 1024:.2f} KB)')
-    axes[0].axis('off')
-
-    png_path_vis = os.path.join(output_dir, f'{base_filename}_compressed_level9.png')
-    img_png_vis = cv2.imread(png_path_vis)
-    img_png_vis = cv2.cvtColor(img_png_vis, cv2.COLOR_BGR2RGB) if is_color else cv2.imread(png_path_vis, cv2.IMREAD_GRAYSCALE)
-    if img_png_vis is not None:
-        png_size_vis = os.path.getsize(png_path_vis)
-        axes[1].imshow(img_png_vis, cmap=cmap_val)
-        axes[1].set_title(f'PNG Level 9 ({png_size_vis / 1024:.2f} KB)')
+@st.cache_data
+def process_png_compression(image_key, _img, is_color, original_size_bytes, max_workers=None, optipng_level=DEFAULT_LEVEL,
+                            _group=None):
+    """PNG sweep results, in the same (table, thumbnails) form and with the
+    same cache key as process_jpeg_compression. optipng runs under `_group`
+    (see png_sweep_group); rows whose optipng job did not finish are marked
+    in the 'optipng' column and never saved. An optipng_level of None
+    skips optipng."""
+    img = _img
+    if not get_png_optimizer().available:
+        optipng_level = None
+    evaluated, _ = stored_sweep(
+        img, is_color, original_size_bytes, 'PNG',
+        partial(evaluate_png_level, img, is_color, original_size_bytes, optipng_level=optipng_level, group=_group),
+        PNG_LEVELS, options={'optipng_level': optipng_level},
+        max_workers=max_workers, storable=lambda row: row['optipng'] not in INCOMPLETE
+    )
+    df_results = pd.DataFrame([row for _, row in evaluated])
+
+    original = thumbnail(img)
+    thumbnails = {'Original': (original, original_size_bytes / 1024)}
+    sizes = {level: row['FileSize Opt (KB)'] for level, row in evaluated}
+    if 9 in sizes:
+        # lossless: the level 9 file decodes to the original pixels
+        thumbnails['PNG Level 9'] = (original, sizes[9])
+    return df_results, thumbnails
+
+def jpeg_export_files(img, is_color, base_filename):
+    return {f'{base_filename}_jpeg_{quality}.jpg': encode_image(img, is_color, '.jpg', [cv2.IMWRITE_JPEG_QUALITY, quality])
+            for quality in JPEG_QUALITIES}
+
+def png_export_files(img, is_color, base_filename, optipng_level=DEFAULT_LEVEL, group=None):
+    encoded = [encode_image(img, is_color, '.png', [cv2.IMWRITE_PNG_COMPRESSION, level]) for level in PNG_LEVELS]
+    if optipng_level is None:
+        optimized = encoded
     else:
-        axes[1].set_title('PNG Level 9 (Error)')
-    axes[1].axis('off')
-
-    plt.tight_layout()
-
-    graf_dir = os.path.join(output_dir, 'grafik')
-    os.makedirs(graf_dir, exist_ok=True)
-
-    fig1, ax1 = plt.subplots(figsize=(10, 6))
-    ax1.set_xlabel('PNG Compression Level')
-    ax1.set_ylabel('File Size (KB)', color='tab:blue')
-    ax1.plot(df_png['Level'], df_png['FileSize Opt (KB)'], marker='o', label='File Size', color='tab:blue')
-    ax1.tick_params(axis='y', labelcolor='tab:blue')
+        optimized = [data for data, _ in get_png_optimizer().optimize_many(encoded, optipng_level, group)]
+    return {f'{base_filename}_compressed_level{level}.png': data for level, data in zip(PNG_LEVELS, optimized)}
+
+class Codec:
+    """An OpenCV encoder setup: file extension plus imencode parameters for
+    each setting (quality, compression level, ...) along one rate axis."""
+
+    def __init__(self, name, ext, params, settings, lossless=False):
+        self.name = name
+        self.ext = ext
+        self.params = params
+        self.settings = tuple(settings)
+        self.lossless = lossless
+
+    def encode(self, img, is_color, setting):
+        return encode_image(img, is_color, self.ext, self.params(setting))
+
+CODECS = {}
+
+def register_codec(codec):
+    CODECS[codec.name] = codec
+    return codec
+
+LOSSY_QUALITIES = (95, 85, 75, 50, 25, 10)
+
+register_codec(Codec('JPEG', '.jpg', lambda q: [cv2.IMWRITE_JPEG_QUALITY, q], LOSSY_QUALITIES))
+register_codec(Codec('JPEG optimized', '.jpg', lambda q: [
+    cv2.IMWRITE_JPEG_QUALITY, q, cv2.IMWRITE_JPEG_OPTIMIZE, 1], LOSSY_QUALITIES))
+register_codec(Codec('JPEG progressive', '.jpg', lambda q: [
+    cv2.IMWRITE_JPEG_QUALITY, q, cv2.IMWRITE_JPEG_OPTIMIZE, 1, cv2.IMWRITE_JPEG_PROGRESSIVE, 1], LOSSY_QUALITIES))
+register_codec(Codec('JPEG 4:4:4', '.jpg', lambda q: [
+    cv2.IMWRITE_JPEG_QUALITY, q, cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444], LOSSY_QUALITIES))
+register_codec(Codec('WebP', '.webp', lambda q: [cv2.IMWRITE_WEBP_QUALITY, q], LOSSY_QUALITIES))
+# OpenCV switches WebP to lossless for quality > 100
+register_codec(Codec('WebP lossless', '.webp', lambda q: [cv2.IMWRITE_WEBP_QUALITY, q], (101,), lossless=True))
+# compression ratio x1000; 1000 is lossless
+register_codec(Codec('JPEG 2000', '.jp2', lambda x: [cv2.IMWRITE_JPEG2000_COMPRESSION_X1000, x], (500, 250, 100, 50, 25, 10)))
+register_codec(Codec('PNG', '.png', lambda level: [cv2.IMWRITE_PNG_COMPRESSION, level], (9,), lossless=True))
+
+def evaluate_codec(img, is_color, original_size_bytes, job, reference=None):
+    name, setting = job
+    data = CODECS[name].encode(img, is_color, setting)
+    if data is None:
+        return None
+    decoded = decode_encoded(data, is_color)
+    if decoded is None or decoded.shape != img.shape:
+        return None
+    identical = np.array_equal(img, decoded)
+    if reference is None:
+        reference = ssim_reference(img, is_color)
+    height, width = img.shape[:2]
+    row = {
+        'Codec': name,
+        'Setting': setting,
+        'FileSize (KB)': len(data) / 1024,
+        'BPP': len(data) * 8 / (height * width),
+        'CompressionRatio': original_size_bytes / len(data) if len(data) > 0 else float('inf'),
+        'PSNR (dB)': float('inf') if identical else cv2.PSNR(img, decoded),
+        'SSIM': compute_ssim(reference, decoded),
+        'Identical': identical
+    }
+    return row, data, decoded
+
+def rate_distortion_table(img, is_color, original_size_bytes, codec_names=None, max_workers=None):
+    """Run every setting of the selected codecs through the metric pipeline
+    in parallel; rows follow the registry order, then the setting order."""
+    codec_names = list(CODECS) if codec_names is None else codec_names
+    jobs = [(name, setting) for name in codec_names for setting in CODECS[name].settings]
+    evaluated, _ = stored_sweep(
+        img, is_color, original_size_bytes, 'rate_distortion',
+        partial(evaluate_codec, img, is_color, original_size_bytes),
+        jobs, max_workers=max_workers
+    )
+    return pd.DataFrame([row for _, row in evaluated])
+
+def bd_rate(anchor_rates, anchor_metric, test_rates, test_metric):
+    """Bjontegaard delta rate in percent: average bitrate change of `test`
+    against `anchor` at equal quality over their overlapping metric range
+    (cubic fit of log-rate vs metric). Negative means `test` is smaller.
+    None when either curve has fewer than four distinct points or the
+    ranges do not overlap."""
+    curves = []
+    for rates, metric in ((anchor_rates, anchor_metric), (test_rates, test_metric)):
+        rates, metric = np.asarray(rates, float), np.asarray(metric, float)
+        finite = np.isfinite(metric) & (rates > 0)
+        rates, metric = rates[finite], metric[finite]
+        if len(np.unique(metric)) < 4:
+            return None
+        curves.append((np.polyfit(metric, np.log(rates), 3), metric))
+    low = max(curves[0][1].min(), curves[1][1].min())
+    high = min(curves[0][1].max(), curves[1][1].max())
+    if high <= low:
+        return None
+    averages = []
+    for fit, _ in curves:
+        integral = np.polyint(fit)
+        averages.append((np.polyval(integral, high) - np.polyval(integral, low)) / (high - low))
+    return (np.exp(averages[1] - averages[0]) - 1) * 100
+
+def bd_rate_summary(table, anchor='JPEG'):
+    """BD-rate of each lossy codec against `anchor` for PSNR and SSIM, plus
+    the size of each lossless codec."""
+    rows = []
+    anchor_rows = table[table['Codec'] == anchor]
+    for name, group in table.groupby('Codec', sort=False):
+        row = {'Codec': name}
+        if CODECS[name].lossless:
+            row['Lossless size (KB)'] = group['FileSize (KB)'].min()
+        elif name != anchor and len(anchor_rows):
+            for metric, column in (('PSNR (dB)', 'BD-rate PSNR (%)'), ('SSIM', 'BD-rate SSIM (%)')):
+                row[column] = bd_rate(anchor_rows['BPP'], anchor_rows[metric].astype(float),
+                                      group['BPP'], group[metric].astype(float))
+        rows.append(row)
+    return pd.DataFrame(rows, columns=['Codec', 'BD-rate PSNR (%)', 'BD-rate SSIM (%)', 'Lossless size (KB)'])
 
-    ax2 = ax1.twinx()
-    ax2.set_ylabel('PSNR (dB)', color='tab:red')
-    ax2.plot(df_png['Level'], df_png['PSNR (dB)'].replace('Infinity', 100).astype(float), marker='s', linestyle='--', color='tab:red', label='PSNR')
-    ax2.tick_params(axis='y', labelcolor='tab:red')
+@st.cache_data
+def process_codec_comparison(img, is_color, original_size_bytes, codec_names, anchor='JPEG', max_workers=None):
+    table = rate_distortion_table(img, is_color, original_size_bytes, codec_names, max_workers)
+    return table, bd_rate_summary(table, anchor)
+
+def codec_comparison_section(img, is_color, original_size_bytes):
+    st.header("Codec Comparison")
+    st.write("Rate-distortion of JPEG variants, WebP, JPEG 2000 and PNG on this image.")
+    codec_names = st.multiselect("Codecs", list(CODECS), default=list(CODECS))
+    if 'JPEG' in codec_names:
+        anchor = 'JPEG'
+    else:
+        anchor = codec_names[0] if codec_names else None
+    if codec_names and st.checkbox("Run codec comparison"):
+        table, summary = process_codec_comparison(img, is_color, original_size_bytes, codec_names, anchor)
+        st.subheader("Rate-Distortion Curves")
+        lossy = table[~table['Identical']]
+        left, right = st.columns(2)
+        left.line_chart(lossy, x='BPP', y='PSNR (dB)', color='Codec')
+        right.line_chart(table, x='BPP', y='SSIM', color='Codec')
+        st.subheader("Rate-Distortion Table")
+        st.dataframe(table.style.format({
+            'FileSize (KB)': '{:.2f}',
+            'BPP': '{:.3f}',
+            'CompressionRatio': '{:.2f}',
+            'PSNR (dB)': '{:.2f}',
+            'SSIM': '{:.4f}'
+        }))
+        st.subheader(f"BD-rate vs {anchor}")
+        st.caption("Average bitrate change at equal quality; negative is smaller than the anchor.")
+        st.dataframe(summary.style.format(precision=2, na_rep='-'))
+
+def quality_maps_section(img, is_color):
+    st.header("Quality Heatmaps")
+    st.write("Per-block PSNR and SSIM of each JPEG quality, aligned to the 8x8 JPEG blocks or 16x16 macroblocks.")
+    if not st.checkbox("Show quality heatmaps"):
+        return
+    left, middle, right = st.columns(3)
+    quality = left.selectbox("JPEG quality", JPEG_QUALITIES)
+    tile = middle.selectbox("Tile size", TILE_SIZES)
+    metric = right.selectbox("Metric", ['SSIM', 'PSNR (dB)'])
+    psnr_map, ssim_map = process_quality_maps(img, is_color, tile)[quality]
+
+    if metric == 'SSIM':
+        values, vmin, vmax = ssim_map, 0.0, 1.0
+    else:
+        # identical tiles (inf) show as the best colour
+        values, vmin, vmax = psnr_map, 20.0, 50.0
+    st.image(heatmap_overlay(img, values, tile, vmin, vmax, width=2 * THUMBNAIL_WIDTH),
+             caption=f'JPEG Q{quality}: {metric} per {tile}x{tile} tile (red = worst)', use_column_width=True)
+    stats = tile_statistics(values)
+    for column, (name, value) in zip(st.columns(3), stats.items()):
+        column.metric(f'{name} {metric}', f'{value:.4f}' if metric == 'SSIM' else f'{value:.2f}')
+    st.subheader("Worst Tiles")
+    st.dataframe(worst_tiles(psnr_map, ssim_map, tile, by=metric).style.format({
+        'PSNR (dB)': '{:.2f}',
+        'SSIM': '{:.4f}'
+    }))
+
+# target name -> (probe metric, satisfied(value, target), label)
+TARGETS = {
+    'max_bytes': ('bytes', lambda value, target: value <= target, 'Max file size (bytes)'),
+    'min_psnr': ('psnr', lambda value, target: value >= target, 'Min PSNR (dB)'),
+    'min_ssim': ('ssim', lambda value, target: value is not None and value >= target, 'Min SSIM'),
+}
+
+METRIC_COLUMNS = {'bytes': 'FileSize (bytes)', 'psnr': 'PSNR (dB)', 'ssim': 'SSIM'}
+
+class JpegProber:
+    """Memoized JPEG probes of one image: each quality is encoded at most
+    once and its PSNR/SSIM are only computed when a search asks for them.
+    Probes keep the encoded bytes and the metrics, not the decoded image."""
+
+    def __init__(self, img, is_color):
+        self.img = img
+        self.is_color = is_color
+        self.probes = {}
+        self.lock = threading.Lock()
+        self._reference = None
+        self._model = None
+        self.predictions = {}
+
+    @property
+    def reference(self):
+        if self._reference is None:
+            self._reference = ssim_reference(self.img, self.is_color)
+        return self._reference
+
+    def predict(self, quality, metric):
+        """Model estimate of 'bytes' or 'psnr' at `quality`, no encoding."""
+        with self.lock:
+            if self._model is None:
+                self._model = JpegSizeModel(self.img, self.is_color)
+            if quality not in self.predictions:
+                self.predictions[quality] = self._model.predict(quality)
+        prediction = self.predictions[quality]
+        return prediction['Predicted Size (bytes)'] if metric == 'bytes' else prediction['Predicted PSNR (dB)']
+
+    def encoded(self, quality):
+        entry = self.probes.setdefault(quality, {})
+        if 'data' not in entry:
+            entry['data'] = encode_image(self.img, self.is_color, '.jpg', [cv2.IMWRITE_JPEG_QUALITY, quality])
+            entry['bytes'] = len(entry['data'])
+        return entry
+
+    def measure(self, quality, metric):
+        with self.lock:
+            entry = self.encoded(quality)
+            if metric not in entry:
+                # decoding again is cheaper than holding a full-size array per probe
+                decoded = decode_encoded(entry['data'], self.is_color)
+                if metric == 'psnr':
+                    entry['psnr'] = cv2.PSNR(self.img, decoded)
+                else:
+                    entry['ssim'] = compute_ssim(self.reference, decoded)
+            return entry[metric]
+
+# a prober holds the image, its SSIM reference and the probes' JPEG files
+PROBER_CACHE_BYTES = 512 * 1024 * 1024
+_probers = LRUCache(max_entries=4, max_bytes=PROBER_CACHE_BYTES)
+
+def get_jpeg_prober(img, is_color):
+    """(cache key, prober); hand both to keep_jpeg_prober after a search."""
+    key = (image_digest(img), is_color)
+    prober = _probers.get(key)
+    return key, JpegProber(img, is_color) if prober is None else prober
+
+def keep_jpeg_prober(key, prober):
+    # (re)cached once searched, so the size budget sees what the search built
+    _probers.put(key, prober)
+
+def first_true(predicate, lo, hi, start=None):
+    """Lowest q in [lo, hi] with predicate(q), for a predicate that is
+    False then True over the range; hi + 1 if it never holds. Given a
+    `start` guess, probes outward from it in doubling steps to bracket the
+    answer before bisecting, so a good guess costs two probes."""
+    below, above = lo - 1, hi + 1
+    if start is not None:
+        step = 1
+        if predicate(start):
+            above = start
+            while above - below > 1:
+                q = max(above - step, below + 1)
+                if not predicate(q):
+                    below = q
+                    break
+                above, step = q, step * 2
+        else:
+            below = start
+            while above - below > 1:
+                q = min(below + step, above - 1)
+                if predicate(q):
+                    above = q
+                    break
+                below, step = q, step * 2
+    while above - below > 1:
+        mid = (below + above) // 2
+        if predicate(mid):
+            above = mid
+        else:
+            below = mid
+    return above
+
+def find_jpeg_quality(img, is_color, target, value, min_quality=1, max_quality=100, use_model=True):
+    """Search JPEG quality for the smallest file that meets `target`.
+
+    For 'min_psnr'/'min_ssim' this is the lowest quality whose metric reaches
+    `value`; for 'max_bytes' it is the highest quality that still fits, i.e.
+    the best image within the budget. File size and both metrics are taken
+    to grow with quality. For size and PSNR targets the analytical
+    JpegSizeModel predicts the answer first and real encodes only confirm
+    it (and correct it if the prediction is off); otherwise, or without
+    `use_model`, the range is bisected. Returns (result, trace): result is
+    a dict with the chosen quality, the predicted one (or None), its size,
+    PSNR, SSIM and encoded bytes, or None if no quality in range meets the
+    target; trace is a DataFrame of the probes.
+    """
+    metric, satisfied, _ = TARGETS[target]
+    prober_key, prober = get_jpeg_prober(img, is_color)
+    trace = []
+
+    def meets(quality):
+        measured = prober.measure(quality, metric)
+        ok = satisfied(measured, value)
+        trace.append({'Step': len(trace) + 1, 'Quality': quality, METRIC_COLUMNS[metric]: measured, 'Meets target': ok})
+        return ok
+
+    # search for the first quality on the high side of the target: for
+    # minimum targets that is the answer, for max_bytes the one above it
+    lowest_first = target != 'max_bytes'
+
+    def high_side(check):
+        return check if lowest_first else lambda quality: not check(quality)
+
+    predicted = start = None
+    if use_model and metric in ('bytes', 'psnr'):
+        predicted_boundary = first_true(
+            high_side(lambda quality: satisfied(prober.predict(quality, metric), value)), min_quality, max_quality)
+        start = min(predicted_boundary, max_quality)
+        predicted = predicted_boundary if lowest_first else predicted_boundary - 1
+        if not min_quality <= predicted <= max_quality:
+            predicted = None
+    boundary = first_true(high_side(meets), min_quality, max_quality, start)
+    found = boundary if lowest_first else boundary - 1
+    if not min_quality <= found <= max_quality:
+        found = None
+
+    result = None
+    if found is not None:
+        result = {
+            'Quality': found,
+            'Predicted Quality': predicted,
+            'FileSize (KB)': prober.measure(found, 'bytes') / 1024,
+            'PSNR (dB)': prober.measure(found, 'psnr'),
+            'SSIM': prober.measure(found, 'ssim'),
+            'data': prober.probes[found]['data'],
+        }
+    keep_jpeg_prober(prober_key, prober)
+    return result, pd.DataFrame(trace)
+
+def target_search_section(img, is_color, base_filename, original_size_bytes):
+    st.header("Target Search")
+    st.write("Find the JPEG quality that gives the smallest file meeting a size, PSNR or SSIM target.")
+    target = st.selectbox("Target", list(TARGETS), format_func=lambda name: TARGETS[name][2])
+    if target == 'max_bytes':
+        value = st.number_input(TARGETS[target][2], min_value=1, value=max(1, original_size_bytes // 4), step=1024)
+    elif target == 'min_psnr':
+        value = st.number_input(TARGETS[target][2], min_value=0.0, max_value=100.0, value=35.0, step=0.5)
+    else:
+        value = st.number_input(TARGETS[target][2], min_value=0.0, max_value=1.0, value=0.95, step=0.01, format="%.3f")
+
+    if st.button("Find Quality"):
+        result, trace = find_jpeg_quality(img, is_color, target, value)
+        if result is None:
+            st.warning("No JPEG quality between 1 and 100 meets this target.")
+        else:
+            st.success(f"Quality {result['Quality']}: {result['FileSize (KB)']:.2f} KB, "
+                       f"PSNR {result['PSNR (dB)']:.2f} dB, SSIM {result['SSIM']:.4f}")
+            if result['Predicted Quality'] is not None:
+                st.caption(f"The DCT model predicted quality {result['Predicted Quality']}; "
+                           f"{len(trace)} encodes confirmed the answer.")
+            st.download_button("Download JPEG", result['data'],
+                               file_name=f"{base_filename}_jpeg_{result['Quality']}.jpg", mime="image/jpeg")
+        st.subheader("Probe Trace")
+        st.dataframe(trace)
+
+ESTIMATE_SETTINGS = {
+    'JPEG': [(q, '.jpg', [cv2.IMWRITE_JPEG_QUALITY, q]) for q in JPEG_QUALITIES],
+    'PNG': [(level, '.png', [cv2.IMWRITE_PNG_COMPRESSION, level]) for level in PNG_LEVELS],
+}
 
-    lines1, labels1 = ax1.get_legend_handles_labels()
-    lines2, labels2 = ax2.get_legend_handles_labels()
-    ax1.legend(lines1 + lines2, labels1 + labels2, loc='upper right')
-    plt.title('PNG Compression vs File Size and PSNR')
-    plt.grid(True)
+@st.cache_data
+def process_compression_estimate(img, is_color, fmt, samples=DEFAULT_SAMPLES, max_workers=None):
+    """The JPEG or PNG sweep estimated from a stratified tile sample, with
+    95% intervals. PNG sizes are before optipng."""
+    sample = TileSample(img, samples=samples)
+    return estimate_compression(img, is_color, ESTIMATE_SETTINGS[fmt], sample, ssim_win_size(img), max_workers)
+
+ESTIMATE_FORMAT = {
+    'FileSize (KB)': '{:.2f}',
+    'FileSize Low (KB)': '{:.2f}',
+    'FileSize High (KB)': '{:.2f}',
+    'PSNR (dB)': '{:.2f}',
+    'PSNR Low (dB)': '{:.2f}',
+    'PSNR High (dB)': '{:.2f}',
+    'SSIM': '{:.4f}',
+    'SSIM Low': '{:.4f}',
+    'SSIM High': '{:.4f}'
+}
+
+def show_estimate(estimate, x):
+    st.dataframe(estimate.rename(columns={'Setting': x}).style.format(ESTIMATE_FORMAT))
+    charts = estimate.rename(columns={'Setting': x})
+    for column, (metric, low, high) in zip(st.columns(3), (
+        ('FileSize (KB)', 'FileSize Low (KB)', 'FileSize High (KB)'),
+        ('PSNR (dB)', 'PSNR Low (dB)', 'PSNR High (dB)'),
+        ('SSIM', 'SSIM Low', 'SSIM High'),
+    )):
+        values = charts[[x, metric, low, high]].replace([np.inf, -np.inf], np.nan)
+        if values[metric].notna().any():
+            column.line_chart(values, x=x, y=[metric, low, high])
+
+def show_validation(estimate, df_full, key):
+    """Estimate vs the full sweep; PSNR is compared as 'PSNR Manual',
+    which is inf for identical files like the estimate."""
+    actual = df_full.assign(**{'PSNR (dB)': pd.to_numeric(df_full['PSNR Manual'], errors='coerce')})
+    actual = actual.set_index(key).reindex(estimate['Setting']).reset_index(drop=True)
+    table = validation_table(estimate, actual).rename(columns={'Setting': key})
+    st.dataframe(table.style.format(precision=2, na_rep='-'))
+
+def png_sweep_group(signature):
+    """optipng group for this page run. When the PNG sweep settings
+    (`signature`, None for no sweep) differ from the previous run's, the
+    jobs that run left behind are cancelled; otherwise they are joined."""
+    group, previous = st.session_state.get("png_sweep_group", (None, None))
+    if signature != previous or group is None:
+        if group is not None:
+            get_png_optimizer().cancel(group)
+        group = uuid.uuid4().hex
+    st.session_state["png_sweep_group"] = (group, signature)
+    return group
+
+def png_sweep(image_key, img, is_color, original_size_bytes, optipng_level, group):
+    df_png, thumbnails = process_png_compression(
+        image_key, img, is_color, original_size_bytes, optipng_level=optipng_level, _group=group)
+    incomplete = df_png.loc[df_png['optipng'].isin(INCOMPLETE), 'optipng']
+    if len(incomplete):
+        # retried on the next run instead of served from the cache
+        process_png_compression.clear(
+            image_key, img, is_color, original_size_bytes, optipng_level=optipng_level, _group=group)
+        st.warning(f"optipng did not finish on {len(incomplete)} of {len(df_png)} levels "
+                   f"({', '.join(sorted(set(incomplete)))}); their 'FileSize Opt' is the unoptimized size. "
+                   "These rows are not saved and optipng runs again on the next rerun.")
+    return df_png, thumbnails
+
+def estimate_section(img, image_key, is_color, original_size_bytes):
+    pixels = img.shape[0] * img.shape[1]
+    st.write(f"Results are estimated from a stratified sample of {DEFAULT_TILE}x{DEFAULT_TILE} tiles "
+             f"({pixels / 1e6:.0f} MP image), with 95% confidence intervals (Low/High). Each setting stops "
+             f"encoding tiles once its intervals are within {DEFAULT_TOLERANCE:.0%} of the estimate; "
+             f"the Tiles column shows how many it used.")
+    samples = st.slider("Sampled tiles (at most)", 16, 256, DEFAULT_SAMPLES, step=16)
+
+    st.header("JPEG Compression Estimate")
+    df_jpeg = process_compression_estimate(img, is_color, 'JPEG', samples)
+    show_estimate(df_jpeg, 'Quality')
+    st.header("PNG Compression Estimate")
+    st.caption("Sizes without optipng.")
+    df_png = process_compression_estimate(img, is_color, 'PNG', samples)
+    show_estimate(df_png, 'Level')
+
+    if st.checkbox("Validate against a full run"):
+        st.caption("Intervals cover the tile sampling only; encoding tiles separately adds a small bias of its own.")
+        st.subheader("JPEG: Estimate vs Full Run")
+        full_jpeg, _ = process_jpeg_compression(image_key, img, is_color, original_size_bytes)
+        show_validation(df_jpeg, full_jpeg, 'Quality')
+        st.subheader("PNG: Estimate vs Full Run")
+        full_png, _ = png_sweep(image_key, img, is_color, original_size_bytes, DEFAULT_LEVEL,
+                                png_sweep_group((image_key, DEFAULT_LEVEL)))
+        full_png = full_png.assign(Level=full_png['Method'].str.extract(r'Level (\d)', expand=False).astype(int))
+        show_validation(df_png, full_png, 'Level')
+    else:
+        png_sweep_group(None)
+
+def show_thumbnails(thumbnails):
+    for column, (label, (image, size_kb)) in zip(st.columns(len(thumbnails)), thumbnails.items()):
+        column.image(image, caption=f'{label} ({size_kb:.2f} KB)', use_column_width=True)
+
+def show_size_comparison(labels, sizes_kb):
+    sizes = pd.DataFrame({'File': labels, 'FileSize (KB)': sizes_kb})
+    st.bar_chart(sizes, x='File', y='FileSize (KB)')
+
+def show_jpeg_charts(df_jpeg, original_size_bytes):
+    st.subheader("Quality vs File Size, PSNR, SSIM")
+    for column, metric in zip(st.columns(3), ('FileSize (KB)', 'PSNR (dB)', 'SSIM')):
+        column.line_chart(df_jpeg, x='Quality', y=metric)
+
+    st.subheader("File Size Comparison")
+    show_size_comparison(['Original'] + [f'JPEG Q{q}' for q in df_jpeg['Quality']],
+                         [original_size_bytes / 1024] + df_jpeg['FileSize (KB)'].tolist())
+
+def show_png_charts(df_png, original_size_bytes):
+    df_png = df_png.assign(Level=df_png['Method'].str.extract(r'Level (\d)', expand=False).astype(int))
+    st.subheader("Compression Level vs File Size and PSNR")
+    st.line_chart(df_png, x='Level', y=['FileSize (KB)', 'FileSize Opt (KB)'])
+    psnr = pd.to_numeric(df_png['PSNR (dB)'], errors='coerce')
+    if np.isfinite(psnr).any():
+        st.line_chart(df_png.assign(**{'PSNR (dB)': psnr}), x='Level', y='PSNR (dB)')
+    else:
+        st.caption("PSNR is infinite at every level: PNG is lossless.")
+
+    st.subheader("File Size Comparison")
+    show_size_comparison(['Original'] + [f'PNG {level}' for level in df_png['Level']],
+                         [original_size_bytes / 1024] + df_png['FileSize Opt (KB)'].tolist())
+
+def sweep_sections(img, image_key, is_color, base_filename, original_size_bytes):
+    st.header("JPEG Compression Analysis")
+    df_jpeg, jpeg_thumbnails = process_jpeg_compression(image_key, img, is_color, original_size_bytes)
+
+    st.subheader("Comparison Images")
+    show_thumbnails(jpeg_thumbnails)
+
+    st.subheader("Results Table")
+    st.dataframe(df_jpeg.style.format({
+        'FileSize (KB)': '{:.2f}',
+        'FileSize Opt (KB)': '{:.2f}',
+        'CompressionRatio': '{:.2f}',
+        'PSNR (dB)': '{:.2f}',
+        'PSNR Manual': '{:.2f}',
+        'SSIM': '{:.4f}'
+    }))
+    if st.checkbox("Export JPEG files"):
+        st.download_button("Download JPEG files (.zip)", zip_files(jpeg_export_files(img, is_color, base_filename)),
+                           file_name=f"{base_filename}_jpeg.zip", mime="application/zip")
+
+    show_jpeg_charts(df_jpeg, original_size_bytes)
+
+    quality_maps_section(img, is_color)
+
+    st.header("PNG Compression Analysis")
+    if get_png_optimizer().available:
+        run_optipng = st.checkbox("Run optipng", value=True)
+        optipng_level = st.slider("optipng optimization level", 0, 7, DEFAULT_LEVEL, disabled=not run_optipng)
+        st.caption(f"optipng gets {DEFAULT_TIMEOUT} s per file. Unchecking 'Run optipng' or changing the "
+                   "level stops the optipng jobs still running for this image.")
+        if not run_optipng:
+            optipng_level = None
+    else:
+        optipng_level = None
+        st.caption("optipng not found; 'FileSize Opt' equals the unoptimized size.")
+    group = png_sweep_group((image_key, optipng_level))
+    df_png, png_thumbnails = png_sweep(image_key, img, is_color, original_size_bytes, optipng_level, group)
+
+    st.subheader("Comparison Images")
+    show_thumbnails(png_thumbnails)
+
+    st.subheader("Results Table")
+    st.dataframe(df_png.style.format({
+        'FileSize (KB)': '{:.2f}',
+        'FileSize Opt (KB)': '{:.2f}',
+        'CompressionRatio': '{:.2f}',
+        'PSNR (dB)': '{}',
+        'PSNR Manual': '{}',
+        'SSIM': '{:.4f}'
+    }))
+    if st.checkbox("Export PNG files"):
+        st.download_button("Download PNG files (.zip)", zip_files(png_export_files(img, is_color, base_filename, optipng_level, group)),
+                           file_name=f"{base_filename}_png.zip", mime="application/zip")
+
+    show_png_charts(df_png, original_size_bytes)
 
-    labels = [f'PNG {int(l)}' for l in df_png['Level']]
-    file_sizes = df_png['FileSize Opt (KB)'].tolist()
-    labels.insert(0, 'Original')
-    file_sizes.insert(0, original_size_bytes / 1024)
+def main():
+    st.title("Image Compression Analysis")
+    st.write("Upload an image to analyze JPEG and PNG compression effects on file size, PSNR, and SSIM.")
+    stored = get_uploaded_image("Choose an image...", type=["jpg", "png"])
 
-    fig2, ax3 = plt.subplots(figsize=(12, 6))
-    bars = ax3.bar(labels, file_sizes, color='skyblue')
-    ax3.set_ylabel('File Size (KB)')
-    ax3.set_title('File Size Comparison')
-    ax3.set_xticklabels(labels, rotation=45, ha='right')
+    if stored is not None:
+        original_size_bytes = stored.size_bytes
+        base_filename = stored.base_name
+        img_bgr = stored.image
 
-    for bar in bars:
-        yval = bar.get_height()
-        ax3.annotate(f'{yval:.1f}', xy=(bar.get_x() + bar.get_width() / 2, yval),
-                     xytext=(0, 3), textcoords="offset points", ha='center', va='bottom')
+        is_color = len(img_bgr.shape) == 3
+        img = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB) if is_color else img_bgr
 
-    plt.tight_layout()
+        pixels = img.shape[0] * img.shape[1]
+        modes = ("Full sweep", "Sampled estimate")
+        mode = st.radio("Analysis mode", modes, index=int(pixels > LARGE_IMAGE_PIXELS), horizontal=True)
+        if mode == "Sampled estimate":
+            estimate_section(img, stored.key, is_color, original_size_bytes)
+        else:
+            sweep_sections(img, stored.key, is_color, base_filename, original_size_bytes)
 
-    return df_results, fig, fig1, fig2
+        codec_comparison_section(img, is_color, original_size_bytes)
 
-def main():
-    st.title("Image Compression Analysis")
-    st.write("Upload an image to analyze JPEG and PNG compression effects on file size, PSNR, and SSIM.")
-    uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "png"])
-
-    if uploaded_file is not None:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_img_path = os.path.join(temp_dir, uploaded_file.name)
-            with open(temp_img_path, "wb") as f:
-                f.write(uploaded_file.getvalue())
-            
-            original_size_bytes = os.path.getsize(temp_img_path)
-            base_filename = os.path.splitext(os.path.basename(temp_img_path))[0]
-            
-            img_bgr = cv2.imread(temp_img_path)
-            if img_bgr is None:
-                st.error(f"Error: Cannot load image from {temp_img_path}")
-                return
-
-            is_color = len(img_bgr.shape) == 3
-            img = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB) if is_color else img_bgr
-
-            st.header("JPEG Compression Analysis")
-            jpeg_dir = os.path.join(temp_dir, 'Image_jpeg')
-            df_jpeg, jpeg_comp_fig, jpeg_graph1, jpeg_graph2 = process_jpeg_compression(img, is_color, original_size_bytes, jpeg_dir, base_filename)
-            
-            st.subheader("Comparison Images")
-            st.pyplot(jpeg_comp_fig)
-            
-            st.subheader("Results Table")
-            st.dataframe(df_jpeg.style.format({
-                'FileSize (KB)': '{:.2f}',
-                'FileSize Opt (KB)': '{:.2f}',
-                'CompressionRatio': '{:.2f}',
-                'PSNR (dB)': '{:.2f}',
-                'PSNR Manual': '{:.2f}',
-                'SSIM': '{:.4f}'
-            }))
-            
-            st.subheader("Quality vs File Size, PSNR, SSIM")
-            st.pyplot(jpeg_graph1)
-            
-            st.subheader("File Size Comparison")
-            st.pyplot(jpeg_graph2)
-
-            st.header("PNG Compression Analysis")
-            png_dir = os.path.join(temp_dir, 'Image_png')
-            df_png, png_comp_fig, png_graph1, png_graph2 = process_png_compression(img, is_color, original_size_bytes, png_dir, base_filename)
-            
-            st.subheader("Comparison Images")
-            st.pyplot(png_comp_fig)
-            
-            st.subheader("Results Table")
-            st.dataframe(df_png.style.format({
-                'FileSize (KB)': '{:.2f}',
-                'FileSize Opt (KB)': '{:.2f}',
-                'CompressionRatio': '{:.2f}',
-                'PSNR (dB)': '{}',
-                'PSNR Manual': '{}',
-                'SSIM': '{:.4f}'
-            }))
-            
-            st.subheader("Compression Level vs File Size and PSNR")
-            st.pyplot(png_graph1)
-            
-            st.subheader("File Size Comparison")
-            st.pyplot(png_graph2)
+        target_search_section(img, is_color, base_filename, original_size_bytes)
 
 if __name__ == "__main__":
     main()
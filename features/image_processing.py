@@ -4,24 +4,24 @@ import numpy as np
 from PIL import Image
 import io
 
+from features.caching import get_result_cache
+from features.image_store import get_uploaded_image
+from features.spectrum import detect_periodic_peaks, get_spectrum_engine, notch_mask
+
 def opencv_to_pil(image):
     if len(image.shape) == 2:
         return Image.fromarray(image.astype(np.uint8))
     else:
         return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
 
-def read_image(uploaded_file):
-    image_data = np.frombuffer(uploaded_file.read(), np.uint8)
-    img = cv2.imdecode(image_data, cv2.IMREAD_COLOR)
-    return img
+KERNELS = {
+    "average": np.ones((3, 3), np.float32) / 9,
+    "sharpen": np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]]),
+    "edge": np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]]),
+}
 
 def apply_convolution(image, kernel_type="average"):
-    if kernel_type == "average":
-        kernel = np.ones((3, 3), np.float32) / 9
-    elif kernel_type == "sharpen":
-        kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-    elif kernel_type == "edge":
-        kernel = np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]])
+    kernel = KERNELS[kernel_type]
     output_img = cv2.filter2D(image, -1, kernel)
     return output_img
 
@@ -33,8 +33,7 @@ def apply_filter(image, filter_type="low"):
     if filter_type == "low":
         filtered_img = cv2.GaussianBlur(image, (5, 5), 0)
     elif filter_type == "high":
-        kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-        filtered_img = cv2.filter2D(image, -1, kernel)
+        filtered_img = cv2.filter2D(image, -1, KERNELS["sharpen"])
     elif filter_type == "band":
         low_pass = cv2.GaussianBlur(image, (9, 9), 0)
         high_pass = image - low_pass
@@ -42,34 +41,61 @@ def apply_filter(image, filter_type="low"):
     return filtered_img
 
 def apply_fourier_transform(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    f = np.fft.fft2(gray)
-    fshift = np.fft.fftshift(f)
-    magnitude_spectrum = 20 * np.log(np.abs(fshift))
+    spectrum = get_spectrum_engine().spectrum(image)
+    magnitude_spectrum = spectrum.resample(spectrum.log_magnitude())
     return magnitude_spectrum
 
 def reduce_periodic_noise(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    f = np.fft.fft2(gray)
-    fshift = np.fft.fftshift(f)
-    rows, cols = gray.shape
+    spectrum = get_spectrum_engine().spectrum(image)
+    rows, cols = spectrum.padded_shape
     crow, ccol = rows // 2, cols // 2
-    mask = np.ones((rows, cols), np.uint8)
+    mask = np.ones((rows, cols), np.float32)
     r = 30
     mask[crow-r:crow+r, ccol-r:ccol+r] = 0
-    fshift = fshift * mask
-    f_ishift = np.fft.ifftshift(fshift)
-    img_back = np.fft.ifft2(f_ishift)
-    img_back = np.abs(img_back)
+    img_back = spectrum.apply_mask(mask)
     return img_back
 
+def reduce_periodic_noise_auto(image, notch="gaussian", radius=None, threshold=6.0, max_peaks=32):
+    spectrum = get_spectrum_engine().spectrum(image)
+    rows, cols = spectrum.padded_shape
+    if radius is None:
+        radius = max(2.0, min(rows, cols) / 512)
+    peaks = detect_periodic_peaks(spectrum.log_magnitude(), threshold=threshold, max_peaks=max_peaks)
+    mask = notch_mask((rows, cols), peaks, radius=radius, kind=notch)
+    img_back = spectrum.apply_mask(mask)
+    frequencies = [((r - rows // 2) / rows, (c - cols // 2) / cols) for r, c in peaks]
+    return img_back, frequencies
+
+def remove_periodic_noise_auto(image, **params):
+    """reduce_periodic_noise_auto without the detected frequencies, so it
+    fits OPERATIONS (image in, image out)."""
+    return reduce_periodic_noise_auto(image, **params)[0]
+
+OPERATIONS = {
+    "convolution": apply_convolution,
+    "zero_padding": apply_zero_padding,
+    "filter": apply_filter,
+    "fourier_transform": apply_fourier_transform,
+    "reduce_periodic_noise": reduce_periodic_noise,
+    "reduce_periodic_noise_auto": remove_periodic_noise_auto,
+}
+
 def main():
+    # imported here because features.proxy builds on this module's operations
+    from features.proxy import choose_proxy, encode_png, preview_operation
+
     st.title("Image Processing with Streamlit")
     st.write("Upload an image and apply various image processing techniques.")
-    uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"])
+    stored = get_uploaded_image("Choose an image...", type=["jpg", "jpeg", "png"])
+
+    if stored is not None:
+        img = stored.image
+        image_key = stored.key
+        cache = get_result_cache()
+
+        def cached(func, **params):
+            return cache.compute(func, img, image_key=image_key, **params)
 
-    if uploaded_file is not None:
-        img = read_image(uploaded_file)
         st.subheader("Original Image")
         st.image(opencv_to_pil(img), use_column_width=True)
 
@@ -78,39 +104,54 @@ def main():
             "Choose a technique:",
             ("Convolution", "Zero Padding", "Filter", "Fourier Transform", "Reduce Periodic Noise")
         )
+        preview = st.checkbox("Preview mode (process at display resolution while adjusting)")
 
         if process_type == "Convolution":
             kernel_type = st.selectbox("Select kernel type:", ["average", "sharpen", "edge"])
-            if st.button("Apply Convolution"):
-                result = apply_convolution(img, kernel_type)
-                st.subheader("Convolution Result")
-                st.image(opencv_to_pil(result), use_column_width=True)
+            name, func, params, label, title = "convolution", apply_convolution, {"kernel_type": kernel_type}, "Apply Convolution", "Convolution Result"
 
         elif process_type == "Zero Padding":
             padding_size = st.slider("Select padding size:", 10, 50, 20)
-            if st.button("Apply Zero Padding"):
-                result = apply_zero_padding(img, padding_size)
-                st.subheader("Zero Padding Result")
-                st.image(opencv_to_pil(result), use_column_width=True)
+            name, func, params, label, title = "zero_padding", apply_zero_padding, {"padding_size": padding_size}, "Apply Zero Padding", "Zero Padding Result"
 
         elif process_type == "Filter":
             filter_type = st.selectbox("Select filter type:", ["low", "high", "band"])
-            if st.button("Apply Filter"):
-                result = apply_filter(img, filter_type)
-                st.subheader("Filter Result")
-                st.image(opencv_to_pil(result), use_column_width=True)
+            name, func, params, label, title = "filter", apply_filter, {"filter_type": filter_type}, "Apply Filter", "Filter Result"
 
         elif process_type == "Fourier Transform":
-            if st.button("Apply Fourier Transform"):
-                result = apply_fourier_transform(img)
-                st.subheader("Fourier Transform Result")
-                st.image(opencv_to_pil(result), use_column_width=True)
+            name, func, params, label, title = "fourier_transform", apply_fourier_transform, {}, "Apply Fourier Transform", "Fourier Transform Result"
 
         elif process_type == "Reduce Periodic Noise":
-            if st.button("Reduce Periodic Noise"):
-                result = reduce_periodic_noise(img)
-                st.subheader("Noise Reduction Result")
-                st.image(opencv_to_pil(result), use_column_width=True)
+            mode = st.selectbox("Select mode:", ["fixed block", "automatic notch"])
+            if mode == "automatic notch":
+                notch = st.selectbox("Select notch type:", ["gaussian", "butterworth"])
+                threshold = st.slider("Peak threshold (sigma):", 3.0, 12.0, 6.0)
+                name, func, params = "reduce_periodic_noise_auto", reduce_periodic_noise_auto, {"notch": notch, "threshold": threshold}
+            else:
+                name, func, params = "reduce_periodic_noise", reduce_periodic_noise, {}
+            label, title = "Reduce Periodic Noise", "Noise Reduction Result"
+
+        def show(title, result):
+            if isinstance(result, tuple):
+                result, frequencies = result
+                st.write(f"Detected {len(frequencies)} periodic components (cycles/pixel, vertical, horizontal):")
+                st.write([(round(fy, 4), round(fx, 4)) for fy, fx in frequencies])
+            st.subheader(title)
+            st.image(opencv_to_pil(result), use_column_width=True)
+            return result
+
+        if preview:
+            proxy, scale = choose_proxy(stored)
+            show(f"{title} (preview {proxy.shape[1]}x{proxy.shape[0]})", preview_operation(name, proxy, scale, **params))
+            if st.button("Render full resolution"):
+                full = show(f"{title} (full resolution {img.shape[1]}x{img.shape[0]})", cached(func, **params))
+                st.download_button("Download result", encode_png(full), file_name=f"{stored.base_name}_{name}.png", mime="image/png")
+        elif st.button(label):
+            show(title, cached(func, **params))
+
+        stats = cache.stats()
+        st.caption(f"Result cache: {stats['hits']} hits, {stats['misses']} misses, "
+                   f"{stats['entries']} entries ({stats['bytes'] / 1024 ** 2:.1f} MB)")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
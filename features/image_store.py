@@ -0,0 +1,87 @@
+import os
+
+import cv2
+import numpy as np
+import streamlit as st
+
+from features.caching import bytes_digest
+
+PYRAMID_SCALES = (2, 4, 8)
+MAX_SESSION_IMAGES = 2
+
+def decode_image(data, flags=cv2.IMREAD_COLOR):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+
+class StoredImage:
+    """An upload decoded once, plus a lazily built 1/2, 1/4, 1/8 preview pyramid.
+
+    All arrays handed out are read-only views shared between pages.
+    """
+
+    def __init__(self, image, name, size_bytes, key):
+        image.setflags(write=False)
+        self.image = image
+        self.name = name
+        self.size_bytes = size_bytes
+        self.key = key
+        self._pyramid = None
+
+    @property
+    def base_name(self):
+        return os.path.splitext(os.path.basename(self.name))[0]
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def pyramid(self):
+        if self._pyramid is None:
+            levels = {1: self.image}
+            previous = self.image
+            for scale in PYRAMID_SCALES:
+                height, width = self.image.shape[:2]
+                size = (max(1, width // scale), max(1, height // scale))
+                level = cv2.resize(previous, size, interpolation=cv2.INTER_AREA)
+                level.setflags(write=False)
+                levels[scale] = level
+                previous = level
+            self._pyramid = levels
+        return self._pyramid
+
+    def level(self, scale):
+        return self.pyramid()[scale]
+
+def _session_store():
+    if "image_store" not in st.session_state:
+        st.session_state["image_store"] = {}
+    return st.session_state["image_store"]
+
+def store_upload(uploaded_file):
+    store = _session_store()
+    data = uploaded_file.getvalue()
+    key = bytes_digest(data)
+    if key not in store:
+        image = decode_image(data)
+        if image is None:
+            return None
+        store[key] = StoredImage(image, uploaded_file.name, len(data), key)
+        while len(store) > MAX_SESSION_IMAGES:
+            store.pop(next(iter(store)))
+    st.session_state["image_store_current"] = key
+    return store[key]
+
+def current_image():
+    key = st.session_state.get("image_store_current")
+    return _session_store().get(key) if key else None
+
+def get_uploaded_image(label="Choose an image...", type=("jpg", "jpeg", "png")):
+    uploaded_file = st.file_uploader(label, type=list(type))
+    if uploaded_file is not None:
+        stored = store_upload(uploaded_file)
+        if stored is None:
+            st.error(f"Error: Cannot decode image {uploaded_file.name}")
+        return stored
+    stored = current_image()
+    if stored is not None:
+        st.caption(f"Using previously uploaded image: {stored.name}")
+    return stored
@@ -0,0 +1,170 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from functools import partial
+
+from features.caching import LRUCache, bytes_digest
+
+# looked up once; without the binary every PNG is returned unchanged
+OPTIPNG = shutil.which("optipng")
+DEFAULT_LEVEL = 7
+DEFAULT_TIMEOUT = 120
+# cancelled groups remembered so their later submits are refused
+CANCELLED_GROUPS = 256
+# statuses of jobs that returned the input without a verdict on the file;
+# they are never cached, so the next request runs optipng again
+INCOMPLETE = frozenset({"timeout", "failed", "cancelled"})
+
+class _Job:
+    def __init__(self):
+        self.future = None
+        self.process = None
+        self.groups = set()
+        self.cancelled = False
+
+class PngOptimizer:
+    """Runs optipng on encoded PNGs with a bounded number of processes.
+
+    Every result is a (bytes, status) pair. The status is "optimized",
+    "unoptimized" when optipng is not available, or one of INCOMPLETE when
+    the job timed out after `timeout` seconds, failed or was cancelled; the
+    bytes are then the input unchanged. Only optimized files are cached, by
+    the hash of the input bytes and the optimization level, so analysing
+    the same image again does not start optipng at all.
+
+    Jobs are submitted on behalf of a `group` (a page run, say) and the
+    same file is only optimized once however many groups ask for it.
+    cancel(group) drops the jobs no other group still waits for, and the
+    group's later submits resolve as cancelled straight away.
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL, timeout=DEFAULT_TIMEOUT, max_workers=None,
+                 binary=OPTIPNG, max_cache_bytes=128 * 1024 ** 2):
+        self.level = level
+        self.timeout = timeout
+        self.binary = binary
+        self.cache = LRUCache(max_bytes=max_cache_bytes, sizeof=len)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._cancelled = LRUCache(max_entries=CANCELLED_GROUPS)
+
+    @property
+    def available(self):
+        return self.binary is not None
+
+    def _run(self, data, level, job):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "image.png")
+            with open(path, "wb") as f:
+                f.write(data)
+            process = subprocess.Popen([self.binary, f"-o{level}", "-quiet", path],
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            with self._lock:
+                job.process = process
+                if job.cancelled:
+                    process.kill()
+            try:
+                returncode = process.wait(self.timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+                return None, "timeout"
+            finally:
+                with self._lock:
+                    job.process = None
+            if job.cancelled:
+                return None, "cancelled"
+            if returncode != 0:
+                return None, "failed"
+            with open(path, "rb") as f:
+                return f.read(), "optimized"
+
+    def _optimize(self, data, level, key, job):
+        optimized, status = self._run(data, level, job)
+        if optimized is None:
+            return data, status
+        # optipng never writes a larger file, but keep the smaller one anyway
+        optimized = min(optimized, data, key=len)
+        self.cache.put(key, optimized)
+        return optimized, status
+
+    def _forget(self, key, job, future):
+        with self._lock:
+            if self._jobs.get(key) is job:
+                del self._jobs[key]
+
+    def submit(self, data, level=None, group=None):
+        """Future resolving to (bytes, status); joins the job already
+        running for the same bytes and level."""
+        level = self.level if level is None else level
+        key = (bytes_digest(data), level)
+        cached = self.cache.get(key)
+        if cached is not None or not self.available:
+            future = Future()
+            future.set_result((data, "unoptimized") if cached is None else (cached, "optimized"))
+            return future
+        with self._lock:
+            if group is not None and self._cancelled.get(group):
+                future = Future()
+                future.set_result((data, "cancelled"))
+                return future
+            job = self._jobs.get(key)
+            new = job is None
+            if new:
+                job = self._jobs[key] = _Job()
+                job.future = self.pool.submit(self._optimize, data, level, key, job)
+            job.groups.add(group)
+        if new:
+            # outside the lock: a job that already finished calls back at once
+            job.future.add_done_callback(partial(self._forget, key, job))
+        return job.future
+
+    def optimize(self, data, level=None, group=None):
+        return self.optimize_many([data], level, group)[0]
+
+    def optimize_many(self, items, level=None, group=None):
+        futures = [self.submit(data, level, group) for data in items]
+        results = []
+        for data, future in zip(items, futures):
+            try:
+                results.append(future.result())
+            except CancelledError:
+                results.append((data, "cancelled"))
+        return results
+
+    def cancel(self, group=None):
+        """Drop the queued jobs of `group` (every job when None) and kill
+        their running optipng processes. A job another group also submitted
+        keeps running for that group. Returns the number of jobs stopped."""
+        with self._lock:
+            if group is not None:
+                self._cancelled.put(group, True)
+            stopped = []
+            for key, job in list(self._jobs.items()):
+                if group is not None:
+                    if group not in job.groups:
+                        continue
+                    job.groups.discard(group)
+                    if job.groups:
+                        continue
+                job.cancelled = True
+                # the next submit of this file starts a fresh job
+                del self._jobs[key]
+                stopped.append((job.future, job.process))
+        for future, process in stopped:
+            future.cancel()
+            if process is not None:
+                process.kill()
+        return len(stopped)
+
+_optimizer = None
+
+def get_png_optimizer():
+    global _optimizer
+    if _optimizer is None:
+        _optimizer = PngOptimizer()
+    return _optimizer
@@ -0,0 +1,117 @@
+import cv2
+import numpy as np
+
+from features.image_processing import KERNELS, apply_fourier_transform, reduce_periodic_noise, reduce_periodic_noise_auto
+
+# Width of the main content column (see `.main .block-container` in style.py)
+PREVIEW_WIDTH = 1200
+
+def choose_proxy(stored, viewport_width=PREVIEW_WIDTH):
+    """Smallest pyramid level that still covers the viewport, and its scale."""
+    full_width = stored.shape[1]
+    best = 1
+    for factor, level in stored.pyramid().items():
+        if level.shape[1] >= viewport_width and factor > best:
+            best = factor
+    proxy = stored.level(best)
+    return proxy, proxy.shape[1] / full_width
+
+def gaussian_sigma(ksize):
+    # sigma OpenCV derives for GaussianBlur(..., (ksize, ksize), 0)
+    return 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+
+def scaled_gaussian_blur(image, ksize, scale=1.0):
+    if scale >= 1:
+        return cv2.GaussianBlur(image, (ksize, ksize), 0)
+    return cv2.GaussianBlur(image, (0, 0), gaussian_sigma(ksize) * scale)
+
+_step_gains = {}
+
+def canny_threshold_scale(scale, ksize=5):
+    """Factor for Canny thresholds on a proxy blurred with scaled_gaussian_blur.
+
+    Canny thresholds gradient magnitudes, which are per pixel: an
+    area-downsampled step edge stays about one proxy pixel wide, so its
+    gradient peak grows by less than 1 / scale. The factor is the ratio of
+    the Sobel peaks of a unit step at both resolutions, averaged over where
+    the step falls within a proxy pixel. Edges of wide ramps and fine
+    texture scale differently, so the preview remains approximate.
+    """
+    factor = max(1, round(1 / scale))
+    if factor == 1:
+        return 1.0
+    key = (factor, ksize)
+    if key not in _step_gains:
+        ratios = []
+        for offset in range(factor):
+            step = np.zeros((8, 64 * factor), np.float32)
+            step[:, 32 * factor + offset:] = 1
+            full = cv2.GaussianBlur(step, (ksize, ksize), 0)
+            proxy = cv2.resize(step, (64, 8), interpolation=cv2.INTER_AREA)
+            proxy = cv2.GaussianBlur(proxy, (0, 0), gaussian_sigma(ksize) / factor)
+            full_peak = np.abs(cv2.Sobel(full, cv2.CV_32F, 1, 0)[4]).max()
+            ratios.append(np.abs(cv2.Sobel(proxy, cv2.CV_32F, 1, 0)[4]).max() / full_peak)
+        _step_gains[key] = float(np.mean(ratios))
+    return _step_gains[key]
+
+def scale_kernel(kernel, scale):
+    """Resample a small kernel defined in full-resolution pixels to a proxy.
+
+    The DC gain (kernel sum) is preserved. Once the footprint shrinks below
+    one proxy pixel the kernel collapses to its gain: area-downsampling a
+    zero-sum (edge) response averages it out, and a unit-sum kernel leaves
+    the downsampled image unchanged.
+    """
+    kernel = np.asarray(kernel, np.float32)
+    if scale >= 1:
+        return kernel
+    size = 2 * int(round((kernel.shape[0] * scale - 1) / 2)) + 1
+    if size >= kernel.shape[0]:
+        return kernel
+    gain = kernel.sum()
+    if size <= 1:
+        return np.full((1, 1), gain, np.float32)
+    resized = cv2.resize(kernel, (size, size), interpolation=cv2.INTER_AREA)
+    resized += (gain - resized.sum()) / resized.size
+    return resized
+
+def preview_convolution(image, scale, kernel_type="average"):
+    return cv2.filter2D(image, -1, scale_kernel(KERNELS[kernel_type], scale))
+
+def preview_zero_padding(image, scale, padding_size=10):
+    padding = int(round(padding_size * scale))
+    return cv2.copyMakeBorder(image, padding, padding, padding, padding, cv2.BORDER_CONSTANT, value=[0, 0, 0])
+
+def preview_filter(image, scale, filter_type="low"):
+    if filter_type == "low":
+        return scaled_gaussian_blur(image, 5, scale)
+    if filter_type == "high":
+        return cv2.filter2D(image, -1, scale_kernel(KERNELS["sharpen"], scale))
+    low_pass = scaled_gaussian_blur(image, 9, scale)
+    return low_pass + (image - low_pass)
+
+def preview_reduce_periodic_noise_auto(image, scale, radius=None, **params):
+    # notch radii are in frequency bins, i.e. cycles per image, which a
+    # downsampled image shares with the original up to its own Nyquist limit
+    if radius is None:
+        height, width = image.shape[:2]
+        radius = max(2.0, min(height, width) / scale / 512)
+    return reduce_periodic_noise_auto(image, radius=radius, **params)
+
+PREVIEWS = {
+    "convolution": preview_convolution,
+    "zero_padding": preview_zero_padding,
+    "filter": preview_filter,
+    "fourier_transform": lambda image, scale: apply_fourier_transform(image),
+    "reduce_periodic_noise": lambda image, scale: reduce_periodic_noise(image),
+    "reduce_periodic_noise_auto": preview_reduce_periodic_noise_auto,
+}
+
+def preview_operation(name, image, scale, **params):
+    return PREVIEWS[name](image, scale, **params)
+
+def encode_png(image):
+    if image.dtype != np.uint8:
+        image = np.clip(image, 0, 255).astype(np.uint8)
+    ok, buffer = cv2.imencode(".png", image)
+    return buffer.tobytes() if ok else None
@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+import pandas as pd
+
+from features.ssim_engine import K1, K2
+
+TILE_SIZES = (8, 16)
+
+def tile_sums(values, tile):
+    """Per-tile sums of an (H, W[, C]) array whose H and W are multiples of `tile`.
+
+    Two reshape-and-reduce passes, no loops: the tile's rows are summed
+    first, over contiguous memory, then the columns within each tile.
+    """
+    height, width = values.shape[:2]
+    rows, cols, channels = height // tile, width // tile, values.shape[2:]
+    row_sums = values.reshape(rows, tile, -1).sum(axis=1)
+    return row_sums.reshape((rows, cols, tile) + channels).sum(axis=2)
+
+def pad_to_tiles(image, tile):
+    height, width = image.shape[:2]
+    pad_rows, pad_cols = -height % tile, -width % tile
+    if not pad_rows and not pad_cols:
+        return image
+    padding = ((0, pad_rows), (0, pad_cols)) + ((0, 0),) * (image.ndim - 2)
+    return np.pad(image, padding)
+
+class TileQualityReference:
+    """Per-tile PSNR and SSIM of candidates against one reference image.
+
+    Tiles start at the top-left corner, so 8x8 and 16x16 tiles line up
+    with JPEG blocks and macroblocks. Each tile is one SSIM window (block
+    SSIM, sample covariance), so the maps need only tile sums; the
+    reference's tile means and variances are computed once. Edge tiles
+    that extend past the image only count the pixels inside it.
+    """
+
+    def __init__(self, reference, tile=8, data_range=255):
+        self.tile = tile
+        self.shape = reference.shape
+        self.data_range = data_range
+        self.c1 = np.float32((K1 * data_range) ** 2)
+        self.c2 = np.float32((K2 * data_range) ** 2)
+        # second moments about a global offset keep float32 sums exact enough
+        self.offset = np.float32(reference.mean())
+        self.reference = pad_to_tiles(reference.astype(np.float32) - self.offset, tile)
+        ones = pad_to_tiles(np.ones(reference.shape[:2], np.float32), tile)
+        self.counts = tile_sums(ones, tile)
+        self.channel_counts = self.counts if reference.ndim == 2 else self.counts[..., None]
+        self.mean = tile_sums(self.reference, tile) / self.channel_counts
+        self.variance = self._covariance(tile_sums(self.reference * self.reference, tile), self.mean, self.mean)
+
+    def _covariance(self, sum_products, mean_a, mean_b):
+        counts = self.channel_counts
+        return (sum_products / counts - mean_a * mean_b) * (counts / np.maximum(counts - 1, 1))
+
+    @property
+    def grid_shape(self):
+        return self.counts.shape
+
+    def maps(self, candidate):
+        """(psnr_map, ssim_map), one value per tile; PSNR is inf for identical tiles."""
+        if candidate.shape != self.shape:
+            raise ValueError(f"Candidate shape {candidate.shape} differs from reference {self.shape}")
+        tile, counts = self.tile, self.channel_counts
+        other = pad_to_tiles(candidate.astype(np.float32) - self.offset, tile)
+
+        diff = other - self.reference
+        squared = tile_sums(diff * diff, tile)
+        if squared.ndim == 3:
+            squared = squared.sum(axis=2)
+        channels = 1 if candidate.ndim == 2 else candidate.shape[2]
+        mse = squared / (self.counts * channels)
+        with np.errstate(divide="ignore"):
+            psnr = 10 * np.log10(np.float32(self.data_range ** 2) / mse)
+
+        mean_other = tile_sums(other, tile) / counts
+        variance_other = self._covariance(tile_sums(other * other, tile), mean_other, mean_other)
+        covariance = self._covariance(tile_sums(self.reference * other, tile), self.mean, mean_other)
+        mean_ref = self.mean + self.offset
+        mean_oth = mean_other + self.offset
+        ssim = ((2 * mean_ref * mean_oth + self.c1) * (2 * covariance + self.c2)) / \
+            ((mean_ref * mean_ref + mean_oth * mean_oth + self.c1) * (self.variance + variance_other + self.c2))
+        if ssim.ndim == 3:
+            ssim = ssim.mean(axis=2)
+        return psnr, ssim
+
+def worst_tiles(psnr_map, ssim_map, tile, count=10, by="SSIM"):
+    """The `count` lowest-scoring tiles with their pixel position."""
+    values = ssim_map if by == "SSIM" else psnr_map
+    flat = values.ravel()
+    count = min(count, flat.size)
+    order = np.argpartition(flat, count - 1)[:count]
+    order = order[np.argsort(flat[order], kind="stable")]
+    rows, cols = np.unravel_index(order, values.shape)
+    return pd.DataFrame({
+        "Tile Row": rows,
+        "Tile Col": cols,
+        "X": cols * tile,
+        "Y": rows * tile,
+        "PSNR (dB)": psnr_map[rows, cols],
+        "SSIM": ssim_map[rows, cols],
+    })
+
+def tile_statistics(values):
+    finite = values[np.isfinite(values)]
+    if not finite.size:
+        return {"min": np.inf, "p5": np.inf, "mean": np.inf}
+    return {"min": float(finite.min()), "p5": float(np.percentile(finite, 5)), "mean": float(finite.mean())}
+
+def heatmap_overlay(image, values, tile, vmin, vmax, width=None, alpha=0.5):
+    """Blend a per-tile map over an RGB/gray image; low values show red.
+
+    Rendering happens at `width` pixels wide (default: the image width),
+    with the tile grid upscaled by nearest neighbour so tiles stay sharp.
+    """
+    height, full_width = image.shape[:2]
+    width = min(width or full_width, full_width)
+    size = (width, max(1, round(height * width / full_width)))
+    base = cv2.resize(image, size, interpolation=cv2.INTER_AREA) if width != full_width else image
+    if base.ndim == 2:
+        base = cv2.cvtColor(base, cv2.COLOR_GRAY2RGB)
+    clipped = np.clip(np.nan_to_num(values, posinf=vmax), vmin, vmax)
+    scaled = ((vmax - clipped) / max(vmax - vmin, 1e-12) * 255).astype(np.uint8)
+    # the grid covers whole tiles, i.e. the padded extent; scale that, then crop
+    scale = size[0] / full_width
+    rows, cols = values.shape
+    grid = cv2.resize(scaled, (max(size[0], round(cols * tile * scale)), max(size[1], round(rows * tile * scale))),
+                      interpolation=cv2.INTER_NEAREST)[:size[1], :size[0]]
+    colors = cv2.cvtColor(cv2.applyColorMap(grid, cv2.COLORMAP_JET), cv2.COLOR_BGR2RGB)
+    return cv2.addWeighted(base, 1 - alpha, colors, alpha, 0)
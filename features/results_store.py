@@ -0,0 +1,152 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_PATH = os.environ.get(
+    "IMAGE_PROCESSING_RESULTS_DB",
+    os.path.join(os.path.expanduser("~"), ".cache", "image_processing", "compression_results.sqlite3"),
+)
+DEFAULT_MAX_BYTES = 64 * 1024 ** 2
+# check the size budget every this many inserts
+EVICT_INTERVAL = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    image_hash TEXT NOT NULL,
+    codec TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    row TEXT NOT NULL,
+    encoded_size INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (image_hash, codec, settings)
+);
+CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+"""
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot store {type(value).__name__}")
+
+def settings_key(settings):
+    return json.dumps(settings, sort_keys=True, default=_json_default)
+
+class ResultsStore:
+    """Compression metric rows in a local SQLite file, shared by processes.
+
+    Rows are keyed by (pixel hash, codec, settings) and stored as JSON with
+    the encoded size. The database runs in WAL mode so readers never block
+    the writer; every thread/process opens its own connection. When the
+    rows exceed `max_bytes` (checked every EVICT_INTERVAL inserts) the
+    least recently read ones are evicted.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._inserts = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        # connections must not cross threads or a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get_many(self, image_hash, codec, settings_list):
+        """Stored rows for each settings entry, in order; None where missing."""
+        keys = [settings_key(settings) for settings in settings_list]
+        conn = self._connection()
+        placeholders = ",".join("?" * len(keys))
+        found = dict(conn.execute(
+            f"SELECT settings, row FROM results WHERE image_hash = ? AND codec = ? AND settings IN ({placeholders})",
+            [image_hash, codec, *keys],
+        ).fetchall()) if keys else {}
+        if found:
+            with conn:
+                conn.execute(
+                    f"UPDATE results SET accessed = ? WHERE image_hash = ? AND codec = ? AND settings IN ({placeholders})",
+                    [time.time(), image_hash, codec, *found],
+                )
+        return [json.loads(found[key]) if key in found else None for key in keys]
+
+    def get(self, image_hash, codec, settings):
+        return self.get_many(image_hash, codec, [settings])[0]
+
+    def put_many(self, image_hash, codec, items):
+        """Store (settings, row, encoded_size) triples."""
+        now = time.time()
+        records = []
+        for settings, row, encoded_size in items:
+            payload = json.dumps(row, default=_json_default)
+            records.append((image_hash, codec, settings_key(settings), payload, int(encoded_size), len(payload), now))
+        if not records:
+            return
+        conn = self._connection()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+        self._inserts += len(records)
+        if self._inserts >= EVICT_INTERVAL:
+            self._inserts = 0
+            self.evict()
+
+    def put(self, image_hash, codec, settings, row, encoded_size):
+        self.put_many(image_hash, codec, [(settings, row, encoded_size)])
+
+    def evict(self):
+        """Drop least recently read rows until the store fits `max_bytes`."""
+        conn = self._connection()
+        with conn:
+            excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0] - self.max_bytes
+            if excess <= 0:
+                return 0
+            # oldest first, until the removed sizes cover the excess
+            cursor = conn.execute(
+                "DELETE FROM results WHERE rowid IN (SELECT rowid FROM (SELECT rowid, "
+                "SUM(size) OVER (ORDER BY accessed, rowid) - size AS removed_before FROM results) "
+                "WHERE removed_before < ?)",
+                (excess,),
+            )
+            return cursor.rowcount
+
+    def stats(self):
+        entries, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "path": self.path}
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM results")
+
+_store = None
+_configured = False
+
+def configure_results_store(path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+    """Point the shared store at `path`; None disables persistence."""
+    global _store, _configured
+    _store = ResultsStore(path, max_bytes) if path else None
+    _configured = True
+    return _store
+
+def get_results_store():
+    if not _configured:
+        try:
+            configure_results_store()
+        except (OSError, sqlite3.Error):
+            # read-only home or broken file: fall back to computing everything
+            configure_results_store(None)
+    return _store
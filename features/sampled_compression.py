@@ -0,0 +1,284 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from features.quality_maps import pad_to_tiles, tile_sums
+from features.ssim_engine import SSIMReference
+
+# a multiple of 16, so sampled tiles hold whole JPEG MCUs
+DEFAULT_TILE = 256
+DEFAULT_SAMPLES = 64
+DEFAULT_STRATA = 4
+# a setting stops sampling once every 95% interval is within this fraction
+# of its estimate; tiles are added this many at a time
+DEFAULT_TOLERANCE = 0.01
+DEFAULT_BATCH = 8
+# variances from fewer tiles are too rough to stop on
+MIN_TILES = 16
+# texture is measured on a copy downsampled by this factor
+TEXTURE_DOWNSAMPLE = 4
+# two-sided 95% normal quantile
+Z_95 = 1.959964
+
+class TileSample:
+    """A stratified sample of the tiles of one image.
+
+    The image is cut into `tile` x `tile` tiles (smaller at the right and
+    bottom edges). Tiles are put into `strata` groups by the quantiles of
+    their luma standard deviation, and each group gets a share of the
+    `samples` tiles proportional to its tile count times its mean
+    deviation, since textured tiles vary most in compressed size. Every
+    group keeps at least two tiles so its spread can be estimated; if the
+    budget covers the whole image, every tile is taken.
+
+    `order` lists positions in `chosen` so that every prefix is itself a
+    stratified sample: two tiles per group first (`initial` of them), then
+    the rest interleaved in proportion to each group's share.
+    """
+
+    def __init__(self, img, tile=DEFAULT_TILE, samples=DEFAULT_SAMPLES, strata=DEFAULT_STRATA, seed=0):
+        self.tile = tile
+        height, width = img.shape[:2]
+        self.rows, self.cols = -(-height // tile), -(-width // tile)
+        heights = np.minimum(tile, height - np.arange(self.rows) * tile)
+        widths = np.minimum(tile, width - np.arange(self.cols) * tile)
+        self.pixels = np.outer(heights, widths).ravel()
+
+        texture = tile_texture(img, tile).ravel()
+        count = texture.size
+        rng = np.random.default_rng(seed)
+        if samples >= count:
+            self.labels = np.zeros(count, np.int64)
+            self.chosen = np.arange(count)
+            self.order, self.initial = measurement_order(self.labels, rng)
+            return
+        edges = np.quantile(np.log1p(texture), np.linspace(0, 1, strata + 1)[1:-1])
+        self.labels = np.searchsorted(edges, np.log1p(texture), side='right')
+        groups = np.unique(self.labels)
+        sizes = np.array([np.count_nonzero(self.labels == group) for group in groups])
+        spread = np.array([texture[self.labels == group].mean() for group in groups]) + 1e-6
+        allocation = allocate(sizes, spread, samples)
+        self.chosen = np.sort(np.concatenate([
+            rng.choice(np.flatnonzero(self.labels == group), n, replace=False)
+            for group, n in zip(groups, allocation)
+        ]))
+        self.order, self.initial = measurement_order(self.labels[self.chosen], rng)
+
+    def bounds(self, index):
+        """(y0, y1, x0, x1) of tile `index` in the image."""
+        row, col = divmod(int(index), self.cols)
+        y0, x0 = row * self.tile, col * self.tile
+        return y0, y0 + self.tile, x0, x0 + self.tile
+
+    def tiles(self, img):
+        for index in self.chosen:
+            y0, y1, x0, x1 = self.bounds(index)
+            yield img[y0:y1, x0:x1]
+
+def measurement_order(labels, rng):
+    """(order, initial): positions of `labels`, each group shuffled, with
+    the first two of every group up front and the rest sorted by how far
+    into its group they are; `initial` counts the up-front positions."""
+    positions, progress = [], []
+    for group in np.unique(labels):
+        members = rng.permutation(np.flatnonzero(labels == group))
+        ranks = np.arange(members.size)
+        positions.append(members)
+        progress.append(np.where(ranks < 2, -1.0, (ranks + 1) / members.size))
+    positions, progress = np.concatenate(positions), np.concatenate(progress)
+    return positions[np.argsort(progress, kind='stable')], int(np.count_nonzero(progress < 0))
+
+def tile_texture(img, tile):
+    """Standard deviation of luma per tile, from an area-downsampled copy."""
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
+    factor = TEXTURE_DOWNSAMPLE if tile % TEXTURE_DOWNSAMPLE == 0 else 1
+    height, width = gray.shape
+    size = (max(1, -(-width // factor)), max(1, -(-height // factor)))
+    small = cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+    small_tile = tile // factor
+    ones = pad_to_tiles(np.ones(small.shape, np.float32), small_tile)
+    counts = tile_sums(ones, small_tile)
+    padded = pad_to_tiles(small, small_tile)
+    mean = tile_sums(padded, small_tile) / counts
+    variance = tile_sums(padded * padded, small_tile) / counts - mean * mean
+    return np.sqrt(np.maximum(variance, 0))
+
+def allocate(sizes, spread, samples):
+    """Tiles to draw per stratum: proportional to size * spread, largest
+    remainders first, at least min(2, size) each and at most size."""
+    floor = np.minimum(2, sizes)
+    share = sizes * spread
+    target = floor + (samples - floor.sum()) * share / share.sum()
+    allocation = np.minimum(np.floor(target).astype(np.int64), sizes)
+    for index in np.argsort(-(target - allocation)):
+        if allocation.sum() >= samples:
+            break
+        if allocation[index] < sizes[index]:
+            allocation[index] += 1
+    return np.maximum(allocation, floor)
+
+def ratio_estimate(values, pixels, labels, population_pixels, population_labels):
+    """Stratified ratio estimate of a per-pixel mean and its variance.
+
+    `values` and `pixels` belong to the sampled tiles; within a stratum the
+    mean per pixel is sum(values) / sum(pixels), scaled to the stratum's
+    known pixel count. The variance uses the residuals of that ratio and
+    the finite population correction, so a fully sampled stratum adds none.
+    """
+    total = variance = 0.0
+    for group in np.unique(population_labels):
+        in_sample = labels == group
+        x, y = pixels[in_sample], values[in_sample]
+        stratum_pixels = population_pixels[population_labels == group].sum()
+        if x.sum() == 0:
+            continue
+        ratio = y.sum() / x.sum()
+        total += ratio * stratum_pixels
+        n, size = x.size, np.count_nonzero(population_labels == group)
+        if n > 1 and n < size:
+            residuals = y - ratio * x
+            variance += size ** 2 * (1 - n / size) * residuals.var(ddof=1) / n
+    all_pixels = population_pixels.sum()
+    return total / all_pixels, variance / all_pixels ** 2
+
+def encoding_overhead(is_color, ext, params):
+    """Bytes every encoded tile repeats (headers, tables): the size of a
+    tiny flat image in the same format."""
+    flat = np.full((16, 16, 3) if is_color else (16, 16), 128, np.uint8)
+    ok, buffer = cv2.imencode(ext, flat, params)
+    return len(buffer) if ok else 0
+
+def prepare_tiles(tiles, is_color, data_range, win_size=7):
+    """(BGR tile, SSIMReference or None) per sampled tile, so the
+    reference statistics are shared by every setting. Tiles smaller than
+    the SSIM window get no reference."""
+    prepared = []
+    for tile in tiles:
+        bgr = cv2.cvtColor(tile, cv2.COLOR_RGB2BGR) if is_color else np.ascontiguousarray(tile)
+        reference = None
+        if min(tile.shape[:2]) >= win_size:
+            reference = SSIMReference(bgr, data_range=data_range, win_size=win_size,
+                                      channel_axis=2 if is_color else None)
+        prepared.append((bgr, reference))
+    return prepared
+
+def measure_tiles(prepared, is_color, ext, params):
+    """Per prepared tile: (encoded bytes, squared error sum, SSIM * pixels,
+    pixels with SSIM)."""
+    rows = []
+    for bgr, reference in prepared:
+        ok, buffer = cv2.imencode(ext, bgr, params)
+        if not ok:
+            raise ValueError(f"Could not encode a tile as {ext}")
+        decoded = cv2.imdecode(buffer, cv2.IMREAD_COLOR if is_color else cv2.IMREAD_GRAYSCALE)
+        squared_error = cv2.norm(bgr, decoded, cv2.NORM_L2SQR)
+        pixels = bgr.shape[0] * bgr.shape[1]
+        if reference is None:
+            rows.append((len(buffer), squared_error, 0.0, 0))
+        else:
+            # lossless tiles need no SSIM filtering
+            ssim = 1.0 if squared_error == 0 else reference.ssim(decoded)
+            rows.append((len(buffer), squared_error, ssim * pixels, pixels))
+    return np.array(rows, np.float64)
+
+def psnr_from_mse(mse, data_range=255):
+    return 10 * np.log10(data_range ** 2 / mse) if mse > 0 else float('inf')
+
+def sample_estimates(measured, positions, sample, channels, overhead):
+    """(mean, low, high) of bytes, MSE and SSIM per pixel from the tiles
+    at `positions` of sample.chosen, measured as by measure_tiles."""
+    chosen = sample.chosen[positions]
+    labels = sample.labels[chosen]
+    estimates = {}
+    for name, values, pixels in (
+        ('bytes', measured[:, 0] - overhead, sample.pixels[chosen]),
+        ('mse', measured[:, 1] / channels, sample.pixels[chosen]),
+        ('ssim', measured[:, 2], measured[:, 3]),
+    ):
+        mean, variance = ratio_estimate(values, pixels, labels, sample.pixels, sample.labels)
+        half_width = Z_95 * np.sqrt(variance)
+        estimates[name] = (mean, mean - half_width, mean + half_width)
+    return estimates
+
+def converged(estimates, tolerance):
+    return all(high - low <= 2 * tolerance * abs(mean) for mean, low, high in estimates.values())
+
+def estimate_compression(img, is_color, settings, sample=None, win_size=7, max_workers=None,
+                         tolerance=DEFAULT_TOLERANCE, batch=DEFAULT_BATCH):
+    """Size, PSNR and SSIM for each (label, ext, params) setting, estimated
+    from a TileSample with 95% confidence intervals. Settings are measured
+    on a thread pool; OpenCV releases the GIL while encoding.
+
+    Each setting encodes the sampled tiles in sample.order, `batch` at a
+    time after the first MIN_TILES, and stops as soon as every interval is
+    within `tolerance` of its estimate (0 measures them all).
+    Lossless settings and expensive encoder levels are mostly uniform
+    across tiles, so they stop after a fraction of the sample.
+
+    Columns: Setting, FileSize (KB) with Low/High, PSNR (dB) with Low/High,
+    SSIM with Low/High and Tiles (how many were encoded). PSNR comes from
+    the estimated mean squared error, so its interval is that of the MSE
+    mapped through the PSNR.
+    """
+    sample = sample or TileSample(img)
+    channels = img.shape[2] if is_color else 1
+    data_range = float(img.max()) - float(img.min())
+    prepared = prepare_tiles(sample.tiles(img), is_color, data_range, win_size)
+    tiles = [prepared[position] for position in sample.order]
+
+    def measure(setting):
+        _, ext, params = setting
+        overhead = encoding_overhead(is_color, ext, params)
+        count = min(len(tiles), max(sample.initial, MIN_TILES))
+        measured = measure_tiles(tiles[:count], is_color, ext, params)
+        while True:
+            estimates = sample_estimates(measured, sample.order[:count], sample, channels, overhead)
+            if count == len(tiles) or converged(estimates, tolerance):
+                return estimates, overhead, count
+            added = tiles[count:count + batch]
+            measured = np.vstack([measured, measure_tiles(added, is_color, ext, params)])
+            count += len(added)
+
+    workers = max(1, min(len(settings), max_workers or os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        measurements = list(pool.map(measure, settings))
+    rows = []
+    for (label, _, _), (estimates, overhead, count) in zip(settings, measurements):
+        total_pixels = sample.pixels.sum()
+        size_kb = [(mean * total_pixels + overhead) / 1024 for mean in estimates['bytes']]
+        mse, mse_low, mse_high = estimates['mse']
+        rows.append({
+            'Setting': label,
+            'FileSize (KB)': size_kb[0],
+            'FileSize Low (KB)': max(size_kb[1], 0.0),
+            'FileSize High (KB)': size_kb[2],
+            'PSNR (dB)': psnr_from_mse(mse),
+            'PSNR Low (dB)': psnr_from_mse(mse_high),
+            'PSNR High (dB)': psnr_from_mse(max(mse_low, 0.0)),
+            'SSIM': estimates['ssim'][0],
+            'SSIM Low': estimates['ssim'][1],
+            'SSIM High': min(estimates['ssim'][2], 1.0),
+            'Tiles': count,
+        })
+    return pd.DataFrame(rows)
+
+def validation_table(estimate, actual):
+    """Estimate next to a full run's rows (same settings, same order):
+    actual value, relative error and whether it fell inside the interval."""
+    table = pd.DataFrame({'Setting': estimate['Setting']})
+    for column, low, high in (
+        ('FileSize (KB)', 'FileSize Low (KB)', 'FileSize High (KB)'),
+        ('PSNR (dB)', 'PSNR Low (dB)', 'PSNR High (dB)'),
+        ('SSIM', 'SSIM Low', 'SSIM High'),
+    ):
+        measured = pd.to_numeric(actual[column], errors='coerce').to_numpy(dtype=float)
+        predicted = estimate[column].to_numpy(dtype=float)
+        table[f'Estimated {column}'] = predicted
+        table[f'Actual {column}'] = measured
+        with np.errstate(divide='ignore', invalid='ignore'):
+            table[f'{column} Error (%)'] = np.where(measured == predicted, 0.0, (predicted - measured) / measured * 100)
+        table[f'{column} In CI'] = ((estimate[low] <= measured) & (measured <= estimate[high])) | (measured == predicted)
+    return table
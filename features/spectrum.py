@@ -0,0 +1,150 @@
+import cv2
+import numpy as np
+
+from features.caching import LRUCache, image_digest
+
+class Spectrum:
+    """Centred-view helpers around one cached DFT of a grayscale image.
+
+    ``data`` holds the unshifted complex spectrum of the padded image as a
+    two-channel float array (OpenCV layout). The padding mirrors the image
+    edges, so it adds no step edge that would ring after filtering. Masks
+    are given in the usual centred (fftshift-ed) layout and shifted once
+    instead of the spectrum.
+    """
+
+    def __init__(self, data, shape):
+        self.data = data
+        self.shape = shape
+        self.padded_shape = data.shape[:2]
+        self._magnitude = None
+        self._log_magnitude = None
+
+    def complex_view(self):
+        complex_dtype = np.complex128 if self.data.dtype == np.float64 else np.complex64
+        return self.data.view(complex_dtype)[..., 0]
+
+    def magnitude(self):
+        if self._magnitude is None:
+            self._magnitude = np.fft.fftshift(np.abs(self.complex_view()))
+        return self._magnitude
+
+    def log_magnitude(self):
+        if self._log_magnitude is None:
+            self._log_magnitude = 20 * np.log(self.magnitude() + np.finfo(self.data.dtype).tiny)
+        return self._log_magnitude
+
+    @property
+    def nbytes(self):
+        # the complex data plus the magnitude and log-magnitude built on demand
+        return 2 * self.data.nbytes
+
+    def resample(self, centered):
+        """A centred padded-size array resampled to the image shape. Every
+        bin up to Nyquist stays in view (a crop would drop the outermost
+        ones) and the frequency per pixel matches an unpadded spectrum."""
+        rows, cols = self.shape
+        if (rows, cols) == self.padded_shape:
+            return centered
+        return cv2.resize(centered, (cols, rows), interpolation=cv2.INTER_AREA)
+
+    def apply_mask(self, mask, centered=True):
+        if centered:
+            mask = np.fft.ifftshift(mask)
+        filtered = self.complex_view() * mask.astype(self.data.dtype, copy=False)
+        back = cv2.idft(filtered[..., None].view(self.data.dtype), flags=cv2.DFT_SCALE | cv2.DFT_COMPLEX_OUTPUT)
+        rows, cols = self.shape
+        back = np.ascontiguousarray(back[:rows, :cols]).view(filtered.dtype)[..., 0]
+        return np.abs(back)
+
+def detect_periodic_peaks(log_magnitude, threshold=6.0, exclude_radius=None, max_peaks=32,
+                          background_size=31, nms_size=9):
+    rows, cols = log_magnitude.shape
+    crow, ccol = rows // 2, cols // 2
+    if exclude_radius is None:
+        exclude_radius = max(8, min(rows, cols) // 64)
+    log_magnitude = log_magnitude.astype(np.float32, copy=False)
+    # Row/column background so the bright axes cross left by image borders
+    # is treated as background, while isolated spikes stand out of it.
+    background = np.maximum(cv2.blur(log_magnitude, (background_size, 1)),
+                            cv2.blur(log_magnitude, (1, background_size)))
+    residual = log_magnitude - background
+    sample = residual[::7, ::7]
+    median = np.median(sample)
+    sigma = 1.4826 * np.median(np.abs(sample - median)) + 1e-6
+    local_max = log_magnitude >= cv2.dilate(log_magnitude, np.ones((nms_size, nms_size), np.uint8))
+    candidates = local_max & (residual > median + threshold * sigma)
+
+    r, c = np.nonzero(candidates)
+    dy, dx = r - crow, c - ccol
+    # keep one peak of each conjugate pair and skip the DC neighbourhood
+    keep = ((dy > 0) | ((dy == 0) & (dx > 0))) & (dy * dy + dx * dx > exclude_radius ** 2)
+    r, c = r[keep], c[keep]
+    if len(r) > max_peaks:
+        strongest = np.argpartition(residual[r, c], -max_peaks)[-max_peaks:]
+        r, c = r[strongest], c[strongest]
+    order = np.argsort(-residual[r, c])
+    return np.stack([r[order], c[order]], axis=1)
+
+def notch_mask(shape, peaks, radius=3.0, kind="gaussian", order=2):
+    rows, cols = shape
+    crow, ccol = rows // 2, cols // 2
+    if kind == "gaussian":
+        half = int(np.ceil(4 * radius))
+    elif kind == "butterworth":
+        # reach the distance where the notch attenuates by less than 1e-3
+        half = int(np.ceil(radius * 1000 ** (1 / (2 * order))))
+    else:
+        raise ValueError(f"Unknown notch kind '{kind}'")
+    offsets = np.arange(-half, half + 1)
+    d2 = (offsets[:, None] ** 2 + offsets[None, :] ** 2).astype(np.float32)
+    if kind == "gaussian":
+        patch = 1 - np.exp(-d2 / (2 * radius ** 2))
+    else:
+        with np.errstate(divide="ignore"):
+            patch = 1 / (1 + (radius ** 2 / d2) ** order)
+    mask = np.ones(shape, np.float32)
+    peaks = np.asarray(peaks, dtype=np.int64).reshape(-1, 2)
+    if len(peaks) == 0:
+        return mask
+    conjugates = np.stack([2 * crow - peaks[:, 0], 2 * ccol - peaks[:, 1]], axis=1)
+    centers = np.concatenate([peaks, conjugates])
+    row_idx = (centers[:, 0, None, None] + offsets[None, :, None]) % rows
+    col_idx = (centers[:, 1, None, None] + offsets[None, None, :]) % cols
+    np.multiply.at(mask, (row_idx, col_idx), np.broadcast_to(patch, (len(centers),) + patch.shape))
+    return mask
+
+class SpectrumEngine:
+    def __init__(self, max_entries=4, max_bytes=512 * 1024 * 1024):
+        self.cache = LRUCache(max_entries, max_bytes, sizeof=lambda spectrum: spectrum.nbytes)
+
+    def spectrum(self, image):
+        key = image_digest(image)
+        spectrum = self.cache.get(key)
+        if spectrum is None:
+            spectrum = self.compute(image)
+            self.cache.put(key, spectrum)
+        return spectrum
+
+    @staticmethod
+    def compute(image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        # float32 is exact enough for 8/16-bit input; keep float64 data as is
+        dtype = np.float64 if gray.dtype == np.float64 else np.float32
+        rows, cols = gray.shape
+        padded_rows, padded_cols = cv2.getOptimalDFTSize(rows), cv2.getOptimalDFTSize(cols)
+        # mirrored, not zero, padding: zeros next to the image's DC level
+        # form a step edge that rings along the right and bottom borders
+        padded = cv2.copyMakeBorder(gray.astype(dtype, copy=False), 0, padded_rows - rows, 0,
+                                    padded_cols - cols, cv2.BORDER_REFLECT_101)
+        # real-input DFT; OpenCV expands the conjugate-symmetric half itself
+        data = cv2.dft(padded, flags=cv2.DFT_COMPLEX_OUTPUT)
+        return Spectrum(data, (rows, cols))
+
+_engine = None
+
+def get_spectrum_engine():
+    global _engine
+    if _engine is None:
+        _engine = SpectrumEngine()
+    return _engine
@@ -0,0 +1,152 @@
+import cv2
+import numpy as np
+
+# Wang, Simoncelli & Bovik 2003, five scales
+MS_SSIM_WEIGHTS = (0.0448, 0.2856, 0.3001, 0.2363, 0.1333)
+# largest |difference| to skimage.metrics.structural_similarity (default
+# uniform window, sample covariance) seen on 8-bit images
+SKIMAGE_TOLERANCE = 1e-5
+
+K1 = 0.01
+K2 = 0.03
+
+def downsample(image, factor):
+    if factor == 1:
+        return image
+    height, width = image.shape[:2]
+    size = (max(1, width // factor), max(1, height // factor))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+def downsample_float(image, factor):
+    return downsample(np.asarray(image, np.float32), factor)
+
+class WindowStats:
+    """Windowed mean and variance of one float32 image at one scale.
+
+    Second moments are taken about a global `offset` (the image mean) so
+    E[x^2] - E[x]^2 does not lose the variance to float32 cancellation.
+    """
+
+    def __init__(self, image, win_size, offset=None):
+        self.win_size = win_size
+        self.shape = image.shape
+        self.offset = float(image.mean()) if offset is None else offset
+        self.centered = image - np.float32(self.offset)
+        self.mean = self.filter(image)
+        mean_centered = self.mean - np.float32(self.offset)
+        self.variance = self.filter(self.centered * self.centered)
+        self.variance -= mean_centered * mean_centered
+        self.variance *= np.float32(self.cov_norm)
+
+    @property
+    def cov_norm(self):
+        # sample covariance over the 2-D window, as skimage does by default
+        n = self.win_size ** 2
+        return n / (n - 1)
+
+    def filter(self, image):
+        # separable box mean; BORDER_REFLECT matches scipy.ndimage 'reflect'
+        return cv2.blur(image, (self.win_size, self.win_size), borderType=cv2.BORDER_REFLECT)
+
+    def crop(self, values):
+        pad = (self.win_size - 1) // 2
+        return values[pad:values.shape[0] - pad, pad:values.shape[1] - pad]
+
+class SSIMReference:
+    """SSIM of many candidates against one reference image.
+
+    The reference's local means and variances are computed once; each
+    candidate then needs three float32 box filters instead of skimage's
+    five float64 ones. `ssim()` reproduces skimage's structural_similarity
+    (uniform window, sample covariance, mean over channels) within
+    SKIMAGE_TOLERANCE. For very large images `downsample` > 1 compares
+    area-downsampled copies, and `ms_ssim()` gives multi-scale SSIM.
+    """
+
+    def __init__(self, reference, data_range=None, win_size=7, channel_axis=None, downsample=1):
+        reference = np.asarray(reference)
+        if channel_axis is not None and channel_axis % reference.ndim != reference.ndim - 1:
+            raise ValueError("Only a trailing channel axis is supported")
+        spatial = reference.shape[:2]
+        if min(spatial) // downsample < win_size:
+            raise ValueError("win_size exceeds image extent")
+        if win_size % 2 == 0:
+            raise ValueError("Window size must be odd.")
+        if data_range is None:
+            if not np.issubdtype(reference.dtype, np.integer):
+                raise ValueError("data_range is required for floating point images")
+            info = np.iinfo(reference.dtype)
+            data_range = info.max - info.min
+        self.shape = reference.shape
+        self.win_size = win_size
+        self.downsample = downsample
+        self.c1 = np.float32((K1 * data_range) ** 2)
+        self.c2 = np.float32((K2 * data_range) ** 2)
+        self.reference = downsample_float(reference, downsample)
+        self.stats = WindowStats(self.reference, win_size)
+        self._scales = None
+
+    def _check(self, candidate):
+        if candidate.shape != self.shape:
+            raise ValueError(f"Candidate shape {candidate.shape} differs from reference {self.shape}")
+
+    def _terms(self, stats, candidate):
+        """Luminance and contrast-structure maps of `candidate` against `stats`."""
+        filter = stats.filter
+        centered = candidate - np.float32(stats.offset)
+        mean_y = filter(candidate)
+        mean_centered = mean_y - np.float32(stats.offset)
+        variance_y = filter(centered * centered)
+        variance_y -= mean_centered * mean_centered
+        variance_y *= np.float32(stats.cov_norm)
+        covariance = filter(stats.centered * centered)
+        covariance -= (stats.mean - np.float32(stats.offset)) * mean_centered
+        covariance *= np.float32(stats.cov_norm)
+
+        luminance = (2 * stats.mean * mean_y + self.c1) / (stats.mean * stats.mean + mean_y * mean_y + self.c1)
+        contrast_structure = (2 * covariance + self.c2) / (stats.variance + variance_y + self.c2)
+        return luminance, contrast_structure
+
+    def ssim_map(self, candidate):
+        self._check(candidate)
+        luminance, contrast_structure = self._terms(self.stats, downsample_float(candidate, self.downsample))
+        luminance *= contrast_structure
+        return self.stats.crop(luminance)
+
+    def ssim(self, candidate):
+        return float(self.ssim_map(candidate).mean(dtype=np.float64))
+
+    def _ms_scales(self):
+        if self._scales is None:
+            scales = [self.stats]
+            image = self.reference
+            while len(scales) < len(MS_SSIM_WEIGHTS):
+                image = downsample(image, 2)
+                if min(image.shape[:2]) < self.win_size:
+                    break
+                scales.append(WindowStats(image, self.win_size))
+            self._scales = scales
+        return self._scales
+
+    def ms_ssim(self, candidate):
+        """Multi-scale SSIM with the standard five-scale weights.
+
+        Uses the same box window as ssim(); scales that would be smaller
+        than the window are dropped and the remaining weights renormalised.
+        Negative contrast-structure means are clipped to zero.
+        """
+        self._check(candidate)
+        scales = self._ms_scales()
+        weights = np.array(MS_SSIM_WEIGHTS[:len(scales)])
+        weights /= weights.sum()
+        image = downsample_float(candidate, self.downsample)
+        result = 1.0
+        for i, (stats, weight) in enumerate(zip(scales, weights)):
+            if i:
+                image = downsample(image, 2)
+            luminance, contrast_structure = self._terms(stats, image)
+            if i == len(scales) - 1:
+                contrast_structure *= luminance
+            value = max(float(stats.crop(contrast_structure).mean(dtype=np.float64)), 0.0)
+            result *= value ** weight
+        return result
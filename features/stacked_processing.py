@@ -0,0 +1,151 @@
+import itertools
+import time
+from collections.abc import Sequence
+
+import cv2
+import numpy as np
+
+from features.image_processing import KERNELS
+from features.tiled_processing import HALO
+
+class Throughput:
+    def __init__(self):
+        self.images = 0
+        self.seconds = 0.0
+
+    @property
+    def images_per_second(self):
+        return self.images / self.seconds if self.seconds > 0 else 0.0
+
+    def __repr__(self):
+        return f"Throughput({self.images} images in {self.seconds:.3f}s, {self.images_per_second:.1f} images/s)"
+
+class StackProcessor:
+    """Applies one convolution/filter to chunks of equally shaped frames.
+
+    A chunk is filtered as one tall image (a zero-copy view of the stack)
+    straight into the output, so it costs a single OpenCV call instead of
+    one per frame. Only the `halo` rows at the top and bottom of each frame
+    see the neighbouring frame; those are recomputed from small reflect-101
+    padded strips, which keeps the result bit-identical to per-frame
+    apply_convolution / apply_filter. Strip buffers are allocated once and
+    reused for every chunk.
+    """
+
+    def __init__(self, frame_shape, dtype, operation="convolution", kind=None, chunk_size=256):
+        kind = kind or ("average" if operation == "convolution" else "low")
+        if (operation, kind) not in HALO:
+            raise ValueError(f"Unsupported operation {operation}/{kind}")
+        self.operation, self.kind = operation, kind
+        self.frame_shape = tuple(frame_shape)
+        self.chunk_size = chunk_size
+        self.halo = r = HALO[(operation, kind)]
+        if self.frame_shape[0] < 2 * r:
+            raise ValueError(f"Frames need at least {2 * r} rows for {operation}/{kind}")
+        width_and_channels = self.frame_shape[1:]
+        self.strips = np.empty((2 * chunk_size, 3 * r) + width_and_channels, dtype)
+        self.filtered_strips = np.empty_like(self.strips)
+        self.output = np.empty((chunk_size,) + self.frame_shape, dtype)
+
+    def _filter(self, src, dst):
+        operation, kind = self.operation, self.kind
+        if operation == "convolution":
+            cv2.filter2D(src, -1, KERNELS[kind], dst=dst)
+        elif kind == "low":
+            cv2.GaussianBlur(src, (5, 5), 0, dst=dst)
+        elif kind == "high":
+            cv2.filter2D(src, -1, KERNELS["sharpen"], dst=dst)
+        else:
+            cv2.GaussianBlur(src, (9, 9), 0, dst=dst)
+
+    @staticmethod
+    def _tall(stack):
+        return stack.reshape((stack.shape[0] * stack.shape[1],) + stack.shape[2:])
+
+    def process(self, chunk, out=None):
+        n = len(chunk)
+        r = self.halo
+        height = self.frame_shape[0]
+        chunk = np.ascontiguousarray(chunk)
+        out = self.output[:n] if out is None else out
+        if self.operation == "filter" and self.kind == "band" and np.issubdtype(chunk.dtype, np.integer):
+            # low + (image - low) wraps back to the image exactly for integers
+            np.copyto(out, chunk)
+            return out
+        self._filter(self._tall(chunk), self._tall(out))
+
+        # top strips: r reflected rows + first 2r rows; bottom strips: last 2r rows + r reflected rows
+        strips, filtered = self.strips[:2 * n], self.filtered_strips[:2 * n]
+        top, bottom = strips[:n], strips[n:]
+        top[:, r:] = chunk[:, :2 * r]
+        bottom[:, :2 * r] = chunk[:, height - 2 * r:]
+        for i in range(1, r + 1):
+            top[:, r - i] = top[:, r + i]
+            bottom[:, 2 * r - 1 + i] = bottom[:, 2 * r - 1 - i]
+        self._filter(self._tall(strips), self._tall(filtered))
+        out[:, :r] = filtered[:n, r:2 * r]
+        out[:, height - r:] = filtered[n:, r:2 * r]
+
+        if self.operation == "filter" and self.kind == "band":
+            # same (wrapping) arithmetic as apply_filter: low + (image - low)
+            out += chunk - out
+        return out
+
+def _chunks(frames, chunk_size):
+    if isinstance(frames, np.ndarray):
+        for start in range(0, len(frames), chunk_size):
+            yield frames[start:start + chunk_size]
+        return
+    iterator = iter(frames)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield np.stack(chunk)
+
+def iter_process_batch(frames, operation="convolution", kind=None, chunk_size=256, throughput=None, out=None):
+    """Yield processed chunks of an array or iterator of equally shaped frames.
+
+    Yielded arrays are views into a buffer reused for the next chunk; copy
+    them if they must outlive the iteration, or pass an `out` array with
+    room for all frames to have the results written there instead.
+    """
+    processor = None
+    done = 0
+    for chunk in _chunks(frames, chunk_size):
+        start = time.perf_counter()
+        if processor is None:
+            processor = StackProcessor(chunk.shape[1:], chunk.dtype, operation, kind, chunk_size)
+        elif chunk.shape[1:] != processor.frame_shape:
+            raise ValueError(f"Frame shape {chunk.shape[1:]} differs from {processor.frame_shape}")
+        result = processor.process(chunk, None if out is None else out[done:done + len(chunk)])
+        done += len(chunk)
+        if throughput is not None:
+            throughput.seconds += time.perf_counter() - start
+            throughput.images += len(chunk)
+        yield result
+
+def process_batch(frames, operation="convolution", kind=None, chunk_size=256, out=None):
+    """Process an array, sequence or iterator of equally shaped frames.
+
+    Returns (output, Throughput). Iterators are consumed one chunk at a
+    time; without `out` their results are kept chunk by chunk and stacked
+    at the end, since the number of frames is not known up front.
+    """
+    throughput = Throughput()
+    if isinstance(frames, (np.ndarray, Sequence)):
+        frames = np.asarray(frames)
+        if out is None:
+            out = np.empty_like(frames)
+    if out is not None:
+        for _ in iter_process_batch(frames, operation, kind, chunk_size, throughput, out):
+            pass
+        return out, throughput
+    chunks = [chunk.copy() for chunk in iter_process_batch(frames, operation, kind, chunk_size, throughput)]
+    return (np.concatenate(chunks) if chunks else np.empty((0,))), throughput
+
+def apply_convolution_batch(frames, kernel_type="average", chunk_size=256, out=None):
+    return process_batch(frames, "convolution", kernel_type, chunk_size, out)
+
+def apply_filter_batch(frames, filter_type="low", chunk_size=256, out=None):
+    return process_batch(frames, "filter", filter_type, chunk_size, out)
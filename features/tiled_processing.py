@@ -0,0 +1,107 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from features.image_processing import apply_convolution, apply_filter
+
+# Kernel radius of each operation, i.e. how many neighbouring pixels a tile
+# needs on every side so its interior matches the whole-image result.
+HALO = {
+    ("convolution", "average"): 1,
+    ("convolution", "sharpen"): 1,
+    ("convolution", "edge"): 1,
+    ("filter", "low"): 2,
+    ("filter", "high"): 1,
+    ("filter", "band"): 4,
+}
+
+# Full-size temporaries allocated per tile by each operation (band keeps the
+# low-pass, the high-pass and their sum alive at the same time).
+TEMPORARIES = {
+    ("filter", "band"): 3,
+}
+
+OPERATIONS = {
+    "convolution": (apply_convolution, "kernel_type", "average"),
+    "filter": (apply_filter, "filter_type", "low"),
+}
+
+DEFAULT_MAX_MEMORY = 256 * 1024 * 1024
+
+def choose_tile_size(image, halo, temporaries=1, workers=1, max_memory=DEFAULT_MAX_MEMORY):
+    channels = image.shape[2] if image.ndim == 3 else 1
+    bytes_per_pixel = channels * image.dtype.itemsize
+    per_worker = max_memory / max(workers, 1)
+    # one tile in flight holds the input crop plus its temporaries
+    side = int(math.sqrt(per_worker / (bytes_per_pixel * (temporaries + 1)))) - 2 * halo
+    if side < halo + 1:
+        raise ValueError(f"max_memory={max_memory} is too small for a halo of {halo} pixels")
+    return side
+
+def iter_tiles(height, width, tile_size):
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            yield y, min(y + tile_size, height), x, min(x + tile_size, width)
+
+def allocate_output(image, out=None, out_path=None):
+    if out is not None:
+        if out.shape != image.shape or out.dtype != image.dtype:
+            raise ValueError(f"out must have shape {image.shape} and dtype {image.dtype}")
+        return out
+    if out_path is not None:
+        return np.lib.format.open_memmap(out_path, mode="w+", dtype=image.dtype, shape=image.shape)
+    return np.empty_like(image)
+
+def apply_tiled(image, operation="convolution", kind=None, tile_size=None, max_memory=DEFAULT_MAX_MEMORY,
+                out=None, out_path=None, workers=1):
+    if operation not in OPERATIONS:
+        raise ValueError(f"Tiled mode supports: {', '.join(OPERATIONS)}")
+    func, param_name, default_kind = OPERATIONS[operation]
+    kind = kind or default_kind
+    if (operation, kind) not in HALO:
+        raise ValueError(f"Unknown {param_name} '{kind}'")
+    halo = HALO[(operation, kind)]
+    temporaries = TEMPORARIES.get((operation, kind), 1)
+    if tile_size is None:
+        tile_size = choose_tile_size(image, halo, temporaries, workers, max_memory)
+    elif tile_size < halo + 1:
+        raise ValueError(f"tile_size must be at least {halo + 1}")
+
+    height, width = image.shape[:2]
+    output = allocate_output(image, out, out_path)
+
+    def run_tile(bounds):
+        y0, y1, x0, x1 = bounds
+        cy0, cy1 = max(y0 - halo, 0), min(y1 + halo, height)
+        cx0, cx1 = max(x0 - halo, 0), min(x1 + halo, width)
+        # OpenCV's default BORDER_REFLECT_101 on the crop reproduces the
+        # whole-image border exactly where the crop touches the image edge;
+        # elsewhere the halo absorbs the (discarded) reflected pixels.
+        result = func(np.ascontiguousarray(image[cy0:cy1, cx0:cx1]), kind)
+        output[y0:y1, x0:x1] = result[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0]
+
+    tiles = iter_tiles(height, width, tile_size)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # consume lazily so at most a couple of tiles per worker are queued
+            pending = []
+            for bounds in tiles:
+                pending.append(pool.submit(run_tile, bounds))
+                if len(pending) >= 2 * workers:
+                    pending.pop(0).result()
+            for future in pending:
+                future.result()
+    else:
+        for bounds in tiles:
+            run_tile(bounds)
+
+    if isinstance(output, np.memmap):
+        output.flush()
+    return output
+
+def apply_convolution_tiled(image, kernel_type="average", **kwargs):
+    return apply_tiled(image, "convolution", kernel_type, **kwargs)
+
+def apply_filter_tiled(image, filter_type="low", **kwargs):
+    return apply_tiled(image, "filter", filter_type, **kwargs)
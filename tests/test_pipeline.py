@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+
+from features.image_processing import apply_convolution, apply_filter
+from features.pipeline import Pipeline, linear_kernel
+
+CHAIN = ["convolution", ("convolution", {"kernel_type": "sharpen"}), ("filter", {"filter_type": "low"})]
+
+def make_image(height=120, width=160):
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (5, 5), 0)
+    # hard edges, so sharpening overshoots the uint8 range
+    image[40:80, 50:110] = 255
+    image[60:100, 20:60] = 0
+    return image
+
+def float_reference(image, steps):
+    result = image.astype(np.float64)
+    for name, params in steps:
+        result = cv2.filter2D(result, -1, linear_kernel(name, params).astype(np.float64))
+    return np.clip(np.rint(result), 0, 255)
+
+def test_documented_chain_fuses_into_one_stage():
+    pipeline = Pipeline(CHAIN)
+    assert [kind for kind, _, _ in pipeline.stages] == ["fused"]
+    assert pipeline.describe() == ["filter2D 3x3 + sepFilter2D 7x7"]
+
+def test_fused_stage_saturates_once():
+    image = make_image()
+    result = Pipeline(CHAIN)(image)
+    assert result.dtype == np.uint8
+    # away from the borders the fused stage equals the float computation
+    interior = np.s_[8:-8, 8:-8]
+    difference = np.abs(result.astype(int) - float_reference(image, Pipeline(CHAIN).steps))
+    assert difference[interior].max() <= 1
+    # whereas the step-by-step result clips the sharpened intermediate
+    stepwise = apply_filter(apply_convolution(apply_convolution(image, "average"), "sharpen"), "low")
+    assert np.abs(stepwise.astype(int) - result)[interior].max() > 1
+
+def test_expensive_kernels_stay_separate():
+    steps = [("convolution", {"kernel_type": "sharpen"})] * 2
+    pipeline = Pipeline(steps)
+    assert pipeline.describe() == ["filter2D 3x3", "filter2D 3x3"]
+    image = make_image()
+    np.testing.assert_array_equal(pipeline(image), apply_convolution(apply_convolution(image, "sharpen"), "sharpen"))
+
+def test_identity_returns_a_copy():
+    image = make_image()
+    result = Pipeline([("filter", {"filter_type": "band"})])(image)
+    assert result is not image
+    np.testing.assert_array_equal(result, image)